@@ -0,0 +1,189 @@
+# admission.py
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+Memory-budgeted admission control for CarboVista
+Replaces fixed pixel caps with a per-process byte budget:
+each request's peak memory is estimated from its pixel count and
+output format, and the request is admitted, queued, downsampled
+or rejected so in-flight usage stays under the budget.
+"""
+
+# =========================================================
+# 1. COST MODEL
+# =========================================================
+# Approximate peak bytes per sampled pixel, by output format.
+# Dominated by the EE getInfo() JSON (one dict per pixel with 12
+# float properties + geometry), plus the DataFrame and output copy.
+BYTES_PER_PIXEL = {
+    "geojson": 2600,    # /run-analysis, streaming (GeoJSON features)
+    "csv": 2000,        # /download-csv (CSV text)
+    "stats": 1700       # stats-only responses (no per-pixel output)
+}
+
+# Below this a sample is too small for meaningful KPIs
+MIN_PIXELS = 500
+
+
+def available_memory_bytes():
+    """MemAvailable (Linux), else free physical pages, else None"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def server_workers():
+    """Server worker processes sharing this machine's memory"""
+    value = (
+        os.environ.get("CARBOVISTA_WORKERS")
+        or os.environ.get("WEB_CONCURRENCY")     # gunicorn convention
+        or 1
+    )
+    return max(1, int(value))
+
+
+def default_budget_bytes():
+    """
+    CARBOVISTA_MEMORY_BUDGET_MB (per process), else half of the memory
+    available at startup split between the server worker processes
+    (CARBOVISTA_WORKERS / WEB_CONCURRENCY). The other half is headroom
+    for the model, Flask and the EE client, which are not budgeted.
+    """
+    configured = os.environ.get("CARBOVISTA_MEMORY_BUDGET_MB")
+    if configured:
+        return int(float(configured) * 1024 * 1024)
+
+    available = available_memory_bytes()
+    if available is None:
+        available = 2 * 1024 * 1024 * 1024
+    return available // 2 // server_workers()
+
+
+class AdmissionRejected(RuntimeError):
+    """Request cannot be admitted; status is the HTTP code to return"""
+
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.status = status
+
+
+# =========================================================
+# 2. CONTROLLER
+# =========================================================
+class AdmissionController:
+    def __init__(self, budget_bytes, max_wait_s=10.0, min_pixels=MIN_PIXELS):
+        self.budget = budget_bytes
+        self.max_wait_s = max_wait_s
+        self.min_pixels = min_pixels
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._metrics = {
+            "admitted": 0,
+            "downsampled": 0,
+            "rejected": 0,
+            "queued": 0,
+            "waiting": 0,
+            "peak_in_flight_bytes": 0
+        }
+
+    @staticmethod
+    def estimate_bytes(n_pixels, fmt):
+        return int(n_pixels * BYTES_PER_PIXEL[fmt])
+
+    @contextmanager
+    def admit(self, n_pixels, fmt):
+        """
+        Reserves memory for n_pixels in the given output format.
+        Yields the number of pixels granted (≤ n_pixels):
+          - fits now            → admitted as requested
+          - fits once others end → waits up to max_wait_s
+          - larger than budget / still busy → downsampled to what fits
+          - fewer than min_pixels would fit  → AdmissionRejected
+            (503 while other requests hold the budget; 413 when even
+            an idle worker's budget is too small, so retrying is futile)
+        """
+        per_pixel = BYTES_PER_PIXEL[fmt]
+        wanted = self.estimate_bytes(n_pixels, fmt)
+
+        if self.budget // per_pixel < min(n_pixels, self.min_pixels):
+            self._record("rejected")
+            raise AdmissionRejected(
+                "AOI needs more memory than this server allows per request. "
+                "Please reduce the AOI size.",
+                status=413
+            )
+
+        with self._cond:
+            # A single request never reserves more than the whole budget
+            wanted = min(wanted, self.budget)
+            deadline = time.monotonic() + self.max_wait_s
+
+            if self._in_flight + wanted > self.budget:
+                self._metrics["queued"] += 1
+                self._metrics["waiting"] += 1
+                try:
+                    while self._in_flight + wanted > self.budget:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                finally:
+                    self._metrics["waiting"] -= 1
+
+            available = self.budget - self._in_flight
+            granted = min(n_pixels, available // per_pixel)
+
+            if granted < min(n_pixels, self.min_pixels):
+                self._metrics["rejected"] += 1
+                raise AdmissionRejected(
+                    "Server is busy with other analyses. Please try again shortly.",
+                    status=503
+                )
+
+            reserved = granted * per_pixel
+            self._in_flight += reserved
+            self._metrics["admitted"] += 1
+            if granted < n_pixels:
+                self._metrics["downsampled"] += 1
+            self._metrics["peak_in_flight_bytes"] = max(
+                self._metrics["peak_in_flight_bytes"], self._in_flight
+            )
+
+        try:
+            yield granted
+        finally:
+            with self._cond:
+                self._in_flight -= reserved
+                self._cond.notify_all()
+
+    def _record(self, key):
+        with self._cond:
+            self._metrics[key] += 1
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "budget_bytes": self.budget,
+                "in_flight_bytes": self._in_flight,
+                "utilisation": round(self._in_flight / self.budget, 4),
+                **self._metrics
+            }
+
+
+controller = AdmissionController(
+    default_budget_bytes(),
+    max_wait_s=float(os.environ.get("CARBOVISTA_ADMISSION_WAIT_S", 10))
+)
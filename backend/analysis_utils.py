@@ -0,0 +1,282 @@
+# analysis_utils.py
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+"""
+Shared AOI analysis helpers for CarboVista
+Used by /run-analysis, /download-csv and the streaming endpoint
+so every route reports the SAME KPIs
+"""
+
+# =========================================================
+# 1. AOI HELPERS
+# =========================================================
+def aoi_hash(aoi_coords):
+    """
+    Stable hash for AOI polygon.
+    Returns None if AOI is invalid.
+    """
+    try:
+        aoi_str = json.dumps(aoi_coords, sort_keys=True)
+        return hashlib.md5(aoi_str.encode("utf-8")).hexdigest()
+    except Exception:
+        return None
+
+
+def compute_aoi_area_km2(aoi_coords):
+    coords = aoi_coords[0]
+
+    lons = [c[0] for c in coords]
+    lats = [c[1] for c in coords]
+
+    min_lon, max_lon = min(lons), max(lons)
+    min_lat, max_lat = min(lats), max(lats)
+
+    meters_per_deg_lat = 111_320
+    meters_per_deg_lon = 111_320 * np.cos(np.deg2rad(np.mean(lats)))
+
+    width_m = (max_lon - min_lon) * meters_per_deg_lon
+    height_m = (max_lat - min_lat) * meters_per_deg_lat
+
+    area_m2 = width_m * height_m
+    return area_m2 / 1e6  # km²
+
+
+# Memory is governed by the admission controller (admission.py);
+# the area cap only bounds EE compute time for live extraction.
+MAX_AOI_AREA_KM2 = float(os.environ.get("CARBOVISTA_MAX_AOI_KM2", 2.0))
+
+
+# =========================================================
+# 2. EE FEATURES → DATAFRAME
+# =========================================================
+def estimate_aoi_pixels(area_km2, scale=10):
+    """10 m pixels in the AOI (local estimate, no EE round-trip)"""
+    return int(area_km2 * 1e6 / (scale * scale))
+
+
+def features_to_frame(features, feature_names):
+    """
+    Converts EE pixel features (getInfo output) into a DataFrame
+    with model features + lon/lat. Invalid pixels are dropped.
+    Columns are filled directly (no per-pixel row dicts).
+    """
+    columns = {
+        k: np.fromiter(
+            (
+                np.nan if (v := f["properties"].get(k)) is None else v
+                for f in features
+            ),
+            dtype=float,
+            count=len(features)
+        )
+        for k in feature_names
+    }
+    columns["lon"] = np.fromiter(
+        (f["geometry"]["coordinates"][0] for f in features),
+        dtype=float, count=len(features)
+    )
+    columns["lat"] = np.fromiter(
+        (f["geometry"]["coordinates"][1] for f in features),
+        dtype=float, count=len(features)
+    )
+
+    return pd.DataFrame(columns).dropna()
+
+
+def frame_to_geojson_features(df):
+    """Point features with rounded carbon_kg (dashboard map layer)"""
+    return [
+        {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [lon, lat]
+            },
+            "properties": {
+                "carbon_kg": carbon
+            }
+        }
+        for lon, lat, carbon in zip(
+            df["lon"].tolist(),
+            df["lat"].tolist(),
+            df["carbon_kg"].round(2).tolist()
+        )
+    ]
+
+
+def classify_carbon(v):
+    if v >= 60: return "High"
+    if v >= 30: return "Medium"
+    return "Low"
+
+
+# =========================================================
+# 3. DASHBOARD KPIs
+# =========================================================
+def confidence_from(mean_carbon, std_carbon):
+    """Prediction confidence (relative consistency), clipped to [0, 1]"""
+    if mean_carbon > 0:
+        confidence = float(np.exp(-std_carbon / mean_carbon))
+    else:
+        confidence = 0.0
+    return max(0.0, min(confidence, 1.0))
+
+
+def build_stats(
+    carbon_values,
+    area_km2,
+    aoi_address,
+    start_date,
+    end_date,
+    mean_carbon=None,
+    std_carbon=None,
+    n_vegetated_pixels=None
+):
+    """
+    Dashboard statistics from per-pixel carbon predictions (kg C).
+    Totals are area-scaled from the sampled mean; pass mean_carbon
+    and std_carbon to use design-weighted moments (e.g. stratified
+    sampling) instead. Variability and confidence follow the same
+    moments; min / max are always the sample range.
+    n_vegetated_pixels: see stats_from_moments.
+    """
+    carbon = pd.Series(np.asarray(carbon_values, dtype=float))
+
+    if mean_carbon is None and std_carbon is None:
+        variability = float(carbon.std(ddof=0) / carbon.mean())
+    else:
+        variability = None      # derived from the weighted moments
+
+    return stats_from_moments(
+        n_pixels=len(carbon),
+        mean_carbon=carbon.mean() if mean_carbon is None else mean_carbon,
+        std_carbon=carbon.std() if std_carbon is None else std_carbon,
+        min_carbon=carbon.min(),
+        max_carbon=carbon.max(),
+        area_km2=area_km2,
+        aoi_address=aoi_address,
+        start_date=start_date,
+        end_date=end_date,
+        variability=variability,
+        n_vegetated_pixels=n_vegetated_pixels
+    )
+
+
+def class_shares(n_low, n_medium, n_high):
+    """Share of pixels per carbon class (see classify_carbon)"""
+    total = n_low + n_medium + n_high
+    if total == 0:
+        return {"Low": 0.0, "Medium": 0.0, "High": 0.0}
+    return {
+        "Low": round(n_low / total, 4),
+        "Medium": round(n_medium / total, 4),
+        "High": round(n_high / total, 4)
+    }
+
+
+def stats_from_moments(
+    n_pixels,
+    mean_carbon,
+    std_carbon,
+    min_carbon,
+    max_carbon,
+    area_km2,
+    aoi_address,
+    start_date,
+    end_date,
+    variability=None,
+    n_vegetated_pixels=None
+):
+    """
+    Dashboard statistics from summary moments only, for paths that
+    never see individual pixels (precomputed grid, EE-side inference).
+    std_carbon is the sample (ddof=1) standard deviation.
+    n_vegetated_pixels: exact vegetation pixel count of the AOI when
+    known (grid, stratified sampling); otherwise the whole AOI is
+    treated as vegetated.
+    """
+    confidence_score = confidence_from(mean_carbon, std_carbon)
+
+    # --------------------------------------------------
+    # AREA-SCALED CARBON ESTIMATION
+    # --------------------------------------------------
+
+    # AOI area
+    area_ha = area_km2 * 100  # 1 km² = 100 ha
+
+    # Vegetated area (ha)
+    if n_vegetated_pixels is not None:
+        # 10 m × 10 m pixel = 0.01 ha
+        vegetated_area_ha = n_vegetated_pixels / 100
+    else:
+        # NOTE: Vegetation masking is applied upstream, so analysed area ≈ vegetated area
+        vegetated_area_ha = area_ha
+    # Vegetated area in km² (for UI consistency)
+    vegetated_area_km2 = vegetated_area_ha / 100
+
+    # Estimated number of vegetation pixels (10 m × 10 m)
+    estimated_veg_pixels = (vegetated_area_ha * 10_000) / 100
+
+    # Estimated total carbon for full AOI (kg C)
+    total_carbon_kg = mean_carbon * estimated_veg_pixels
+
+    # Total carbon in tonnes (dashboard-friendly)
+    total_carbon_t = total_carbon_kg / 1000
+
+    # Carbon density (kg C / ha)
+    carbon_density = (
+        total_carbon_kg / vegetated_area_ha
+        if vegetated_area_ha > 0 else 0.0
+    )
+
+    # Normalised variability (population std / mean)
+    if variability is None:
+        std_pop = (
+            std_carbon * np.sqrt((n_pixels - 1) / n_pixels)
+            if n_pixels > 1 else 0.0
+        )
+        variability = (
+            float(std_pop / mean_carbon) if mean_carbon else float("nan")
+        )
+
+    # --------------------------------------------------
+    # CARBON VALUE (REFERENCE ONLY)
+    # --------------------------------------------------
+
+    # Convert to CO₂ equivalent (tonnes)
+    co2e_tonnes = total_carbon_kg * 3.67 / 1000
+
+    # Reference valuation (RM 15 / tCO₂e)
+    carbon_value_rm = co2e_tonnes * 15
+
+    return {
+        "n_pixels": int(n_pixels),
+
+        # Per-pixel statistics
+        "mean_acd": float(mean_carbon),
+        "min_acd": float(min_carbon),
+        "max_acd": float(max_carbon),
+        "std_acd": float(std_carbon),
+
+        # AREA-SCALED totals
+        "total_carbon_tonnes": round(total_carbon_t, 2),
+        "carbon_value_rm": round(carbon_value_rm, 2),
+
+        # Derived KPIs
+        "vegetated_area_ha": round(vegetated_area_ha, 2),
+        "vegetated_area_km2": round(vegetated_area_km2, 3),
+        "confidence_score": round(confidence_score, 2),
+        "carbon_density": round(carbon_density, 2),
+        "carbon_variability": variability,
+
+        # AOI metadata
+        "aoi_area_km2": round(area_km2, 3),
+        "aoi_address": aoi_address,
+        "start_date": start_date,
+        "end_date": end_date
+    }
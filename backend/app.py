@@ -5,9 +5,8 @@
 #   2) AOI-based spatial analysis (/run-analysis)
 # ============================================================
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import joblib
 import numpy as np
 import pandas as pd
 import os
@@ -15,48 +14,82 @@ import csv
 import io
 from datetime import datetime
 from pdf_utils import build_pdf
-import hashlib
 import json
 
 from geopy.geocoders import Nominatim
-from gee_utils import init_ee, extract_s2_pixels
+from gee_utils import (
+    init_ee,
+    EE_MAX_FEATURES,
+    extract_s2_pixels,
+    extract_s2_pixel_chunks,
+    lat_band_shares,
+    prepare_stratified_sampling,
+    sample_strata,
+    aoi_carbon_stats_ee
+)
+from ee_model_utils import (
+    forest_to_ee_classifier,
+    asset_model_version,
+    InlineTreesTooLarge
+)
+from model_registry import ModelRegistry
+from request_capture import install_capture
+from sampling_utils import adaptive_stratified_sample, NoVegetationError
+from ee_scheduler import get_info, ee_priority, scheduler, EEQuotaError
+from admission import controller as admission, AdmissionRejected
+from analysis_utils import (
+    MAX_AOI_AREA_KM2,
+    aoi_hash,
+    compute_aoi_area_km2,
+    estimate_aoi_pixels,
+    features_to_frame,
+    frame_to_geojson_features,
+    classify_carbon,
+    confidence_from,
+    build_stats,
+    class_shares,
+    stats_from_moments
+)
+import carbon_grid
 # ------------------------------------------------------------
 # AOI ADDRESS CACHE (keyed by polygon hash)
 # ------------------------------------------------------------
 AOI_ADDRESS_CACHE = {}
 
-def aoi_hash(aoi_coords):
+def resolve_aoi_address(aoi_coords, lookup=True):
     """
-    Stable hash for AOI polygon.
-    Returns None if AOI is invalid.
+    AOI address (SAFE, CACHED).
+    With lookup=False only the cache is consulted.
     """
-    try:
-        aoi_str = json.dumps(aoi_coords, sort_keys=True)
-        return hashlib.md5(aoi_str.encode("utf-8")).hexdigest()
-    except Exception:
-        return None
+    aoi_address = "Unknown location"
 
+    aoi_key = aoi_hash(aoi_coords)
 
-# ------------------------------------------------------------
-# COMPUTE AOI AREA
-# ------------------------------------------------------------
-def compute_aoi_area_km2(aoi_coords):
-    coords = aoi_coords[0]
+    if aoi_key and aoi_key in AOI_ADDRESS_CACHE:
+        aoi_address = AOI_ADDRESS_CACHE[aoi_key]
+
+    elif aoi_key and lookup:
+        try:
+            coords = aoi_coords[0]
+            lons = [c[0] for c in coords]
+            lats = [c[1] for c in coords]
 
-    lons = [c[0] for c in coords]
-    lats = [c[1] for c in coords]
+            lat_c = sum(lats) / len(lats)
+            lon_c = sum(lons) / len(lons)
 
-    min_lon, max_lon = min(lons), max(lons)
-    min_lat, max_lat = min(lats), max(lats)
+            geolocator = Nominatim(user_agent="carbovista")
+            location = geolocator.reverse((lat_c, lon_c), zoom=14)
 
-    meters_per_deg_lat = 111_320
-    meters_per_deg_lon = 111_320 * np.cos(np.deg2rad(np.mean(lats)))
+            if location and location.address:
+                aoi_address = location.address
 
-    width_m = (max_lon - min_lon) * meters_per_deg_lon
-    height_m = (max_lat - min_lat) * meters_per_deg_lat
+        except Exception as e:
+            print("⚠️ Reverse geocoding failed:", e)
 
-    area_m2 = width_m * height_m
-    return area_m2 / 1e6  # km²
+        # Cache result (even if Unknown)
+        AOI_ADDRESS_CACHE[aoi_key] = aoi_address
+
+    return aoi_address
 
 # ------------------------------------------------------------
 # 1️⃣ Initialize Flask + Earth Engine
@@ -67,6 +100,9 @@ CORS(
     expose_headers=["Content-Disposition"]
 )
 
+# Opt-in traffic capture for replay.py (CARBOVISTA_CAPTURE_PATH)
+install_capture(app)
+
 init_ee()
 
 # ------------------------------------------------------------
@@ -74,18 +110,31 @@ init_ee()
 # ------------------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-MODEL_PATH = os.path.join(
-    BASE_DIR,
-    "model",
-    "acd_model.joblib"
+MODEL_DIR = os.environ.get(
+    "CARBOVISTA_MODEL_DIR",
+    os.path.join(BASE_DIR, "model")
 )
 
-model_bundle = joblib.load(MODEL_PATH)
-
-rf_model = model_bundle["model"]
-FEATURES = model_bundle["features"]
-
-print("✅ Model loaded successfully")
+# Drop a retrained *.joblib into MODEL_DIR to hot-swap it.
+# With a shadow fraction > 0 the candidate is scored on live traffic
+# first and promoted via /model-promote or dropped via /model-reject.
+# With N shadow batches configured it is promoted automatically only
+# if its prediction delta and latency stay within the limits.
+registry = ModelRegistry(
+    MODEL_DIR,
+    poll_interval=float(os.environ.get("CARBOVISTA_MODEL_POLL_S", 30)),
+    shadow_fraction=float(os.environ.get("CARBOVISTA_SHADOW_FRACTION", 0)),
+    promote_after=int(os.environ.get("CARBOVISTA_SHADOW_PROMOTE_AFTER", 0)),
+    max_rel_delta=float(os.environ.get("CARBOVISTA_SHADOW_MAX_REL_DELTA", 0.05)),
+    max_latency_ratio=float(
+        os.environ.get("CARBOVISTA_SHADOW_MAX_LATENCY_RATIO", 2.0)
+    )
+).start()
+
+# Candidates must match these features, so they stay valid across swaps
+FEATURES = registry.features
+
+print("✅ Model loaded successfully:", registry.active.version)
 print("✅ Expected features:", FEATURES)
 
 # ------------------------------------------------------------
@@ -98,6 +147,75 @@ def health_check():
         "model": "Random Forest ACD"
     })
 
+# ------------------------------------------------------------
+# 3️⃣a Model registry (hot-swap / shadow evaluation)
+# ------------------------------------------------------------
+@app.route("/model-status", methods=["GET"])
+def model_status():
+    return jsonify(registry.status())
+
+
+@app.route("/model-promote", methods=["POST"])
+def model_promote():
+    if not registry.promote():
+        return jsonify({"error": "No candidate model in shadow mode"}), 400
+    return jsonify(registry.status())
+
+
+@app.route("/model-reject", methods=["POST"])
+def model_reject():
+    if not registry.reject():
+        return jsonify({"error": "No candidate model in shadow mode"}), 400
+    return jsonify(registry.status())
+
+# ------------------------------------------------------------
+# 3️⃣b Earth Engine dispatcher metrics
+# ------------------------------------------------------------
+@app.route("/ee-metrics", methods=["GET"])
+def ee_metrics():
+    return jsonify(scheduler.metrics())
+
+
+def ee_busy_response(e):
+    """503 + Retry-After when EE quota retries are exhausted"""
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    response.headers["Retry-After"] = "30"
+    return response
+
+# ------------------------------------------------------------
+# 3️⃣c Memory admission control
+# ------------------------------------------------------------
+def aoi_area_error(area_km2):
+    """400 response if the AOI is too large for live extraction"""
+    if area_km2 > MAX_AOI_AREA_KM2:
+        return jsonify({
+            "error": f"AOI too large ({area_km2:.2f} km²). "
+                    f"Maximum supported area is {MAX_AOI_AREA_KM2} km²."
+        }), 400
+    return None
+
+
+def requested_pixels(area_km2):
+    """Pixels to sample before admission: whole AOI, up to EE's limit"""
+    return max(1, min(estimate_aoi_pixels(area_km2), EE_MAX_FEATURES))
+
+
+def admission_response(e):
+    response = jsonify({"error": str(e)})
+    response.status_code = e.status
+    if e.status == 503:
+        response.headers["Retry-After"] = "10"
+    return response
+
+
+print(f"✅ Memory budget: {admission.budget / 2**20:.0f} MB per worker")
+
+
+@app.route("/admission-metrics", methods=["GET"])
+def admission_metrics():
+    return jsonify(admission.metrics())
+
 # ------------------------------------------------------------
 # 4️⃣ POINT-BASED prediction (DEBUGGING)
 # ------------------------------------------------------------
@@ -111,7 +229,7 @@ def predict_acd():
 
         tree_preds = np.array([
             tree.predict(X_np)[0]
-            for tree in rf_model.estimators_
+            for tree in registry.active.model.estimators_
         ])
 
         mean_pred = float(tree_preds.mean())
@@ -139,232 +257,469 @@ def predict_acd():
         return jsonify({"error": str(e)}), 400
 
 # ------------------------------------------------------------
-# 5️⃣ AOI-BASED SPATIAL ANALYSIS (FINAL)
+# 4️⃣b ADAPTIVE STRATIFIED SAMPLING
 # ------------------------------------------------------------
-@app.route("/run-analysis", methods=["POST"])
-def run_analysis():
-    try:
-        payload = request.get_json()
+def run_adaptive_sampling(
+    aoi_coords,
+    start_date,
+    end_date,
+    target_precision,
+    pixel_budget=EE_MAX_FEATURES
+):
+    """
+    Samples NDVI strata in rounds (EE sample + inference per round)
+    until the CI on total carbon reaches target_precision.
+    Returns (df, sampling_report).
+    """
+    aoi, composite, stratum_counts = prepare_stratified_sampling(
+        aoi_coords=aoi_coords,
+        start_date=start_date,
+        end_date=end_date
+    )
 
-        aoi_coords = payload.get("aoi")
-        start_date = payload.get("start_date")
-        end_date = payload.get("end_date")
+    def draw(allocation, round_index):
+        fc = sample_strata(aoi, composite, allocation, seed=round_index)
 
-        if not aoi_coords or not start_date or not end_date:
-            return jsonify({"error": "Missing AOI or date range"}), 400
+        df = features_to_frame(
+            get_info(fc).get("features", []), FEATURES + ["stratum"]
+        )
+        if df.empty:
+            return df
 
-        # --------------------------------------------------
-        # AOI area enforcement (backend authority)
-        # --------------------------------------------------
-        area_km2 = compute_aoi_area_km2(aoi_coords)
+        df["stratum"] = df["stratum"].astype(int)
+        df["carbon_kg"] = registry.predict(df[FEATURES].values)
+        return df
 
-        if area_km2 > 2.0:
-            return jsonify({
-                "error": f"AOI too large ({area_km2:.2f} km²). "
-                        "Maximum supported area is 2.0 km²."
-            }), 400
+    return adaptive_stratified_sample(
+        draw,
+        stratum_counts,
+        target_precision=target_precision,
+        max_pixels=pixel_budget
+    )
 
-        # --------------------------------------------------
-        # 1️⃣ Extract pixel-wise Sentinel-2 features (GEE)
-        # --------------------------------------------------
+# ------------------------------------------------------------
+# 5️⃣ AOI-BASED SPATIAL ANALYSIS (FINAL)
+# ------------------------------------------------------------
+def analyse_aoi(
+    aoi_coords,
+    start_date,
+    end_date,
+    area_km2,
+    n_pixels,
+    target_precision=None
+):
+    """
+    Extraction → inference → GeoJSON + stats for an admitted request.
+    Returns the response dict, or an error (response, status) tuple.
+    """
+    # --------------------------------------------------
+    # 1️⃣–3️⃣ Extract pixels (GEE) + ML inference
+    # --------------------------------------------------
+    sampling = None
+    mean_override = None
+    std_override = None
+    n_vegetated = None
+
+    if target_precision is not None:
+        try:
+            df, sampling = run_adaptive_sampling(
+                aoi_coords, start_date, end_date, target_precision,
+                pixel_budget=n_pixels
+            )
+        except NoVegetationError as e:
+            return jsonify({"error": str(e)}), 400
+
+        mean_override = sampling["stratified_mean_acd"]
+        std_override = sampling["stratified_std_acd"]
+        n_vegetated = sampling["n_vegetated_pixels"]
+
+    else:
         fc = extract_s2_pixels(
             aoi_coords=aoi_coords,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            num_pixels=n_pixels
         )
 
-        fc_info = fc.getInfo()
-        features = fc_info.get("features", [])
+        features = get_info(fc).get("features", [])
 
         if len(features) == 0:
             return jsonify({"error": "No valid vegetation pixels found"}), 400
 
-        # --------------------------------------------------
-        # 2️⃣ Convert to pandas DataFrame
-        # --------------------------------------------------
-        rows = []
-        for f in features:
-            props = f["properties"]
-            lon, lat = f["geometry"]["coordinates"]
-
-            row = {k: props.get(k) for k in FEATURES}
-            row["lon"] = lon
-            row["lat"] = lat
-            rows.append(row)
+        df = features_to_frame(features, FEATURES)
 
-        df = pd.DataFrame(rows).dropna()
+        # Drop the raw EE JSON before building the output copy
+        del features
 
         if df.empty:
             return jsonify({"error": "All pixels invalid after filtering"}), 400
 
-        # --------------------------------------------------
-        # 3️⃣ Run ML inference (pixel-wise)
-        # --------------------------------------------------
-        X = df[FEATURES].values
-        df["carbon_kg"] = rf_model.predict(X)
+        df["carbon_kg"] = registry.predict(df[FEATURES].values)
+
+    # Only coordinates + prediction are needed from here on
+    df = df[["lon", "lat", "carbon_kg"]]
+
+    # --------------------------------------------------
+    # 4️⃣ GeoJSON
+    # --------------------------------------------------
+    geojson = {
+        "type": "FeatureCollection",
+        "features": frame_to_geojson_features(df)
+    }
+
+    # --------------------------------------------------
+    # 5️⃣ Dashboard statistics
+    # --------------------------------------------------
+    stats = build_stats(
+        df["carbon_kg"].values,
+        area_km2,
+        resolve_aoi_address(aoi_coords),
+        start_date,
+        end_date,
+        mean_carbon=mean_override,
+        std_carbon=std_override,
+        n_vegetated_pixels=n_vegetated
+    )
+
+    if sampling is not None:
+        # Total = N · stratified mean with N the exact vegetation
+        # pixel count, so the relative CI of the mean carries
+        # straight over to the AOI total
+        total_t = stats["total_carbon_tonnes"]
+        precision = sampling["achieved_precision"]
+        sampling["total_carbon_ci95_tonnes"] = [
+            round(max(0.0, total_t * (1 - precision)), 2),
+            round(total_t * (1 + precision), 2)
+        ]
+        stats["sampling"] = sampling
+
+    return {
+        "stats": stats,
+        "geojson": geojson
+    }
 
-        # --------------------------------------------------
-        # 4️⃣ GeoJSON
-        # --------------------------------------------------
-        geojson = {
-            "type": "FeatureCollection",
-            "features": [
-                {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [r["lon"], r["lat"]]
-                    },
-                    "properties": {
-                        "carbon_kg": round(float(r["carbon_kg"]), 2)
-                    }
-                }
-                for _, r in df.iterrows()
-            ]
-        }
 
-        # --------------------------------------------------
-        # 5️⃣ Additional KPIs (FINAL & MEANINGFUL)
-        # --------------------------------------------------
+# ------------------------------------------------------------
+# /run-analysis
+# ------------------------------------------------------------
+@app.route("/run-analysis", methods=["POST"])
+def run_analysis():
+    try:
+        payload = request.get_json()
 
-        # Pixel counts (for diagnostics / charts)
-        n_total_pixels = len(features)
-        n_valid_pixels = len(df)
+        aoi_coords = payload.get("aoi")
+        start_date = payload.get("start_date")
+        end_date = payload.get("end_date")
+
+        if not aoi_coords or not start_date or not end_date:
+            return jsonify({"error": "Missing AOI or date range"}), 400
 
         # --------------------------------------------------
-        # Basic statistics (per-pixel)
+        # AOI area enforcement (backend authority)
         # --------------------------------------------------
-        mean_carbon = df["carbon_kg"].mean()
-        std_carbon = df["carbon_kg"].std()
+        area_km2 = compute_aoi_area_km2(aoi_coords)
 
-        # Prediction confidence (relative consistency)
-        if mean_carbon > 0:
-            confidence_score = float(np.exp(-std_carbon / mean_carbon))
-        else:
-            confidence_score = 0.0
-        confidence_score = max(0.0, min(confidence_score, 1.0))
+        error = aoi_area_error(area_km2)
+        if error:
+            return error
 
-        # --------------------------------------------------
-        # AREA-SCALED CARBON ESTIMATION
-        # --------------------------------------------------
+        target_precision = None
+        if payload.get("sampling") == "adaptive":
+            try:
+                target_precision = float(payload.get("target_precision", 0.05))
+            except (TypeError, ValueError):
+                target_precision = None
+
+            # NaN also fails the range check
+            if target_precision is None or not 0 < target_precision < 1:
+                return jsonify({
+                    "error": "target_precision must be between 0 and 1"
+                }), 400
+
+        n_requested = requested_pixels(area_km2)
+
+        with admission.admit(n_requested, "geojson") as n_pixels:
+            response = analyse_aoi(
+                aoi_coords, start_date, end_date, area_km2,
+                n_pixels, target_precision
+            )
+
+            if n_pixels < n_requested and isinstance(response, dict):
+                response["stats"]["pixel_budget"] = {
+                    "requested": n_requested,
+                    "granted": n_pixels
+                }
 
-        # AOI area
-        area_ha = area_km2 * 100  # 1 km² = 100 ha
+            # Serialise while the memory is still reserved
+            return jsonify(response) if isinstance(response, dict) else response
 
-        # Vegetated area (ha)
-        # NOTE: Vegetation masking is applied upstream, so analysed area ≈ vegetated area
-        vegetated_area_ha = area_ha
-        # Vegetated area in km² (for UI consistency)
-        vegetated_area_km2 = vegetated_area_ha / 100
+    except AdmissionRejected as e:
+        return admission_response(e)
 
+    except EEQuotaError as e:
+        return ee_busy_response(e)
 
-        # Estimated number of vegetation pixels (10 m × 10 m)
-        estimated_veg_pixels = (vegetated_area_ha * 10_000) / 100
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Estimated total carbon for full AOI (kg C)
-        total_carbon_kg = mean_carbon * estimated_veg_pixels
+# ------------------------------------------------------------
+# 5️⃣b AOI ANALYSIS — PROGRESSIVE STREAM (NDJSON / SSE)
+# ------------------------------------------------------------
+# Events, in order:
+#   header  → AOI metadata (sent before any EE work)
+#   pixels  → GeoJSON point features for one extraction chunk
+#   stats   → same block as /run-analysis "stats"
+#   error   → terminates the stream
+# Default is NDJSON; ?format=sse (or Accept: text/event-stream)
+# switches to server-sent events.
+STREAM_CHUNKS = 4
 
-        # Total carbon in tonnes (dashboard-friendly)
-        total_carbon_t = total_carbon_kg / 1000
 
-        # Carbon density (kg C / ha)
-        carbon_density = (
-            total_carbon_kg / vegetated_area_ha
-            if vegetated_area_ha > 0 else 0.0
-        )
+def _stream_event(kind, body, sse):
+    payload = json.dumps({"type": kind, **body})
+    if sse:
+        return f"event: {kind}\ndata: {payload}\n\n"
+    return payload + "\n"
 
-        carbon_values = df["carbon_kg"].values
-        carbon_variability_norm = float(np.std(carbon_values) / np.mean(carbon_values))
 
-        # --------------------------------------------------
-        # CARBON VALUE (REFERENCE ONLY)
-        # --------------------------------------------------
+@app.route("/run-analysis-stream", methods=["POST"])
+def run_analysis_stream():
+    payload = request.get_json(silent=True) or {}
 
-        # Convert to CO₂ equivalent (tonnes)
-        co2e_tonnes = total_carbon_kg * 3.67 / 1000
+    aoi_coords = payload.get("aoi")
+    start_date = payload.get("start_date")
+    end_date = payload.get("end_date")
 
-        # Reference valuation (RM 15 / tCO₂e)
-        carbon_value_rm = co2e_tonnes * 15
+    if not aoi_coords or not start_date or not end_date:
+        return jsonify({"error": "Missing AOI or date range"}), 400
 
+    area_km2 = compute_aoi_area_km2(aoi_coords)
 
+    error = aoi_area_error(area_km2)
+    if error:
+        return error
 
-        # --------------------------------------------------
-        # AOI ADDRESS (SAFE, CACHED)
-        # --------------------------------------------------
-        aoi_address = "Unknown location"
+    sse = (
+        request.args.get("format") == "sse"
+        or "text/event-stream" in request.headers.get("Accept", "")
+    )
 
-        aoi_key = aoi_hash(aoi_coords)
+    def generate():
+        yield _stream_event("header", {
+            "aoi_area_km2": round(area_km2, 3),
+            "start_date": start_date,
+            "end_date": end_date,
+            "n_chunks": STREAM_CHUNKS
+        }, sse)
+
+        carbon_batches = []
+
+        # Only one band is held in memory at a time. Bands are sized
+        # by their share of the AOI area, so reserve for the largest.
+        n_requested = requested_pixels(area_km2)
+        max_share = max(
+            (share for *_, share in lat_band_shares(aoi_coords, STREAM_CHUNKS)),
+            default=1.0
+        )
+        band_pixels = max(1, int(np.ceil(n_requested * max_share)))
+
+        try:
+            with admission.admit(band_pixels, "geojson") as n_pixels:
+                chunks = extract_s2_pixel_chunks(
+                    aoi_coords=aoi_coords,
+                    start_date=start_date,
+                    end_date=end_date,
+                    n_chunks=STREAM_CHUNKS,
+                    # Largest band = num_pixels · max_share ≤ n_pixels
+                    num_pixels=min(n_requested, int(n_pixels / max_share))
+                )
+
+                for i, n_chunks, fc in chunks:
+                    df = features_to_frame(
+                        get_info(fc).get("features", []), FEATURES
+                    )
+
+                    if df.empty:
+                        continue
+
+                    df["carbon_kg"] = registry.predict(df[FEATURES].values)
+                    carbon_batches.append(df["carbon_kg"].values)
+
+                    yield _stream_event("pixels", {
+                        "chunk": i,
+                        "n_chunks": n_chunks,
+                        "features": frame_to_geojson_features(df)
+                    }, sse)
+
+            if not carbon_batches:
+                yield _stream_event(
+                    "error", {"error": "No valid vegetation pixels found"}, sse
+                )
+                return
+
+            stats = build_stats(
+                np.concatenate(carbon_batches),
+                area_km2,
+                resolve_aoi_address(aoi_coords),
+                start_date,
+                end_date
+            )
+
+            yield _stream_event("stats", {"stats": stats}, sse)
+
+        except Exception as e:
+            yield _stream_event("error", {"error": str(e)}, sse)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
-        if aoi_key and aoi_key in AOI_ADDRESS_CACHE:
-            aoi_address = AOI_ADDRESS_CACHE[aoi_key]
+# ------------------------------------------------------------
+# 5️⃣b' AOI STATS — RF INFERENCE INSIDE EARTH ENGINE
+# ------------------------------------------------------------
+# Every pixel is scored server-side and reduced in one call, so the
+# EE_MAX_FEATURES sample cap and MAX_AOI_AREA_KM2 do not apply here.
+EE_STATS_MAX_AREA_KM2 = 100.0
+
+# Optional FeatureCollection of exported tree strings (large forests).
+# Only used while its model_version matches the active model; after a
+# promotion, re-export it (export_forest_to_asset with model_version).
+EE_RF_ASSET = os.environ.get("EE_RF_ASSET")
+
+# Inline trees above this size would exceed EE's request size limit
+EE_INLINE_TREES_MAX_MB = float(os.environ.get("EE_INLINE_TREES_MAX_MB", 4))
+
+
+class EEClassifierUnavailable(RuntimeError):
+    """Active model cannot be sent to EE (no usable asset, too large inline)"""
+
+_ee_classifier = (None, None)   # (model version, classifier)
+
+
+def get_ee_classifier():
+    """EE classifier for the ACTIVE model (rebuilt after a hot-swap)"""
+    global _ee_classifier
+    active = registry.active
+    if _ee_classifier[0] != active.version:
+        asset_id = EE_RF_ASSET
+        stale = None
+        if asset_id:
+            asset_version = asset_model_version(asset_id)
+            if asset_version != active.version:
+                # Stale asset → inline trees, if they are small enough
+                stale = (
+                    f"{asset_id} holds model {asset_version}, "
+                    f"active is {active.version}"
+                )
+                print(f"⚠️ {stale}; trying inline trees")
+                asset_id = None
+
+        try:
+            classifier = forest_to_ee_classifier(
+                active.model, FEATURES,
+                asset_id=asset_id,
+                max_inline_bytes=int(EE_INLINE_TREES_MAX_MB * 2**20)
+            )
+        except InlineTreesTooLarge as e:
+            action = (
+                f"{stale}. Re-export the asset with export_forest_to_asset."
+                if stale else
+                "Export them with export_forest_to_asset and set EE_RF_ASSET."
+            )
+            raise EEClassifierUnavailable(f"{e}. {action}") from e
+
+        _ee_classifier = (active.version, classifier)
+    return _ee_classifier[1]
+
+
+@app.route("/run-analysis-stats", methods=["POST"])
+def run_analysis_stats():
+    try:
+        payload = request.get_json()
 
-        elif aoi_key:
-            try:
-                coords = aoi_coords[0]
-                lons = [c[0] for c in coords]
-                lats = [c[1] for c in coords]
+        aoi_coords = payload.get("aoi")
+        start_date = payload.get("start_date")
+        end_date = payload.get("end_date")
 
-                lat_c = sum(lats) / len(lats)
-                lon_c = sum(lons) / len(lons)
+        if not aoi_coords or not start_date or not end_date:
+            return jsonify({"error": "Missing AOI or date range"}), 400
 
-                geolocator = Nominatim(user_agent="carbovista")
-                location = geolocator.reverse((lat_c, lon_c), zoom=14)
+        area_km2 = compute_aoi_area_km2(aoi_coords)
 
-                if location and location.address:
-                    aoi_address = location.address
+        if area_km2 > EE_STATS_MAX_AREA_KM2:
+            return jsonify({
+                "error": f"AOI too large ({area_km2:.2f} km²). "
+                        f"Maximum supported area is {EE_STATS_MAX_AREA_KM2} km²."
+            }), 400
 
-            except Exception as e:
-                print("⚠️ Reverse geocoding failed:", e)
+        result = aoi_carbon_stats_ee(
+            aoi_coords=aoi_coords,
+            start_date=start_date,
+            end_date=end_date,
+            classifier=get_ee_classifier(),
+            feature_names=FEATURES
+        )
 
-            # Cache result (even if Unknown)
-            AOI_ADDRESS_CACHE[aoi_key] = aoi_address
+        moments = result.get("moments") or {}
+        n_pixels = int(moments.get("carbon_kg_count") or 0)
 
-        # --------------------------------------------------
-        # Dashboard statistics
-        # --------------------------------------------------
-        stats = {
-            "n_pixels": int(n_valid_pixels),
-
-            # Per-pixel statistics
-            "mean_acd": float(mean_carbon),
-            "min_acd": float(df["carbon_kg"].min()),
-            "max_acd": float(df["carbon_kg"].max()),
-            "std_acd": float(std_carbon),
-
-            # AREA-SCALED totals
-            "total_carbon_tonnes": round(total_carbon_t, 2),
-            "carbon_value_rm": round(carbon_value_rm, 2),
-
-            # Derived KPIs
-            "vegetated_area_ha": round(vegetated_area_ha, 2),
-            "vegetated_area_km2": round(vegetated_area_km2, 3),
-            "confidence_score": round(confidence_score, 2),
-            "carbon_density": round(carbon_density, 2),
-            "carbon_variability": carbon_variability_norm,
-
-            # AOI metadata
-            "aoi_area_km2": round(area_km2, 3),
-            "aoi_address": aoi_address,
-            "start_date": start_date,
-            "end_date": end_date
-        }
+        if n_pixels == 0:
+            return jsonify({"error": "No valid vegetation pixels found"}), 400
 
+        # EE stdDev is the population std; dashboard uses sample std
+        std_pop = moments.get("carbon_kg_stdDev") or 0.0
+        std_carbon = (
+            std_pop * np.sqrt(n_pixels / (n_pixels - 1))
+            if n_pixels > 1 else 0.0
+        )
 
-        return jsonify({
-            "stats": stats,
-            "geojson": geojson
-        })
+        stats = stats_from_moments(
+            n_pixels=n_pixels,
+            mean_carbon=moments["carbon_kg_mean"],
+            std_carbon=std_carbon,
+            min_carbon=moments["carbon_kg_min"],
+            max_carbon=moments["carbon_kg_max"],
+            area_km2=area_km2,
+            aoi_address=resolve_aoi_address(aoi_coords),
+            start_date=start_date,
+            end_date=end_date
+        )
+
+        classes = result.get("classes") or {}
+        stats["class_shares"] = class_shares(
+            *(int(classes.get(str(i), 0)) for i in range(3))
+        )
+        stats["source"] = "ee"
+
+        return jsonify({"stats": stats})
+
+    except EEClassifierUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+
+    except EEQuotaError as e:
+        return ee_busy_response(e)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # ------------------------------------------------------------
-# DOWNLOAD CSV
+# 5️⃣c AOI STATS FROM PRECOMPUTED GRID (live fallback)
 # ------------------------------------------------------------
-@app.route("/download-csv", methods=["POST"])
-def download_csv():
+# query_aoi holds one row of tiles (~600 KB each) at a time, so the
+# cap bounds memory by the AOI width as well as the scan time.
+GRID_MAX_AREA_KM2 = float(os.environ.get("CARBOVISTA_GRID_MAX_AOI_KM2", 500))
+
+
+@app.route("/grid-stats", methods=["POST"])
+def grid_stats():
     try:
         payload = request.get_json()
+
         aoi_coords = payload.get("aoi")
         start_date = payload.get("start_date")
         end_date = payload.get("end_date")
@@ -372,122 +727,209 @@ def download_csv():
         if not aoi_coords or not start_date or not end_date:
             return jsonify({"error": "Missing AOI or date range"}), 400
 
-        # --------------------------------------------------
-        # AOI size enforcement (same as /run-analysis)
-        # --------------------------------------------------
         area_km2 = compute_aoi_area_km2(aoi_coords)
-        if area_km2 > 2.0:
+
+        if area_km2 > GRID_MAX_AREA_KM2:
             return jsonify({
-                "error": f"AOI too large ({area_km2:.2f} km²). Max is 2.0 km²."
+                "error": f"AOI too large ({area_km2:.2f} km²). "
+                        f"Maximum supported area is {GRID_MAX_AREA_KM2} km²."
             }), 400
 
         # --------------------------------------------------
-        # Extract pixels
+        # Grid path (covered tiles + standard period, built
+        # with the model that is currently active)
         # --------------------------------------------------
-        fc = extract_s2_pixels(
-            aoi_coords=aoi_coords,
-            start_date=start_date,
-            end_date=end_date
+        moments = carbon_grid.query_aoi(
+            aoi_coords, start_date, end_date,
+            model_version=registry.active.version
         )
 
-        fc_info = fc.getInfo()
-        features = fc_info.get("features", [])
-
-        if len(features) == 0:
-            return jsonify({"error": "No vegetation pixels found"}), 400
-
-        rows = []
-        for f in features:
-            props = f["properties"]
-            lon, lat = f["geometry"]["coordinates"]
+        if moments is not None:
+            if moments["n_pixels"] == 0:
+                return jsonify({"error": "No valid vegetation pixels found"}), 400
+
+            stats = stats_from_moments(
+                n_pixels=moments["n_pixels"],
+                mean_carbon=moments["mean"],
+                std_carbon=moments["std"],
+                min_carbon=moments["min"],
+                max_carbon=moments["max"],
+                area_km2=area_km2,
+                aoi_address=resolve_aoi_address(aoi_coords),
+                start_date=start_date,
+                end_date=end_date,
+                # Total = exact SAT sum over the AOI's vegetated pixels
+                n_vegetated_pixels=moments["n_pixels"]
+            )
+            stats["class_shares"] = class_shares(
+                *(moments["class_counts"][c] for c in carbon_grid.CLASS_NAMES)
+            )
+            stats["source"] = "grid"
+            return jsonify({"stats": stats})
+
+        # --------------------------------------------------
+        # Live fallback (uncovered tiles / non-standard period /
+        # grid built with another model)
+        # --------------------------------------------------
+        error = aoi_area_error(area_km2)
+        if error:
+            return error
+
+        with admission.admit(requested_pixels(area_km2), "stats") as n_pixels:
+            fc = extract_s2_pixels(
+                aoi_coords=aoi_coords,
+                start_date=start_date,
+                end_date=end_date,
+                num_pixels=n_pixels
+            )
+
+            df = features_to_frame(get_info(fc).get("features", []), FEATURES)
+
+            if df.empty:
+                return jsonify({"error": "No valid vegetation pixels found"}), 400
+
+            df["carbon_kg"] = registry.predict(df[FEATURES].values)
+            classes = df["carbon_kg"].apply(classify_carbon).value_counts()
+
+        stats = build_stats(
+            df["carbon_kg"].values,
+            area_km2,
+            resolve_aoi_address(aoi_coords),
+            start_date,
+            end_date
+        )
+        stats["class_shares"] = class_shares(
+            *(int(classes.get(c, 0)) for c in carbon_grid.CLASS_NAMES)
+        )
+        stats["source"] = "live"
+        return jsonify({"stats": stats})
 
-            row = {k: props.get(k) for k in FEATURES}
-            row["lon"] = lon
-            row["lat"] = lat
-            rows.append(row)
+    except AdmissionRejected as e:
+        return admission_response(e)
 
-        df = pd.DataFrame(rows).dropna()
+    except EEQuotaError as e:
+        return ee_busy_response(e)
 
-        if df.empty:
-            return jsonify({"error": "All pixels invalid after filtering"}), 400
-
-        # --------------------------------------------------
-        # Predict carbon
-        # --------------------------------------------------
-        df["carbon_kg"] = rf_model.predict(df[FEATURES].values)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # --------------------------------------------------
-        # Carbon class
-        # --------------------------------------------------
-        def classify(v):
-            if v >= 60: return "High"
-            if v >= 30: return "Medium"
-            return "Low"
+# ------------------------------------------------------------
+# DOWNLOAD CSV
+# ------------------------------------------------------------
+def build_csv_response(aoi_coords, start_date, end_date, area_km2, n_pixels):
+    # --------------------------------------------------
+    # Extract pixels
+    # --------------------------------------------------
+    # CSV exports queue behind interactive analyses
+    with ee_priority("export"):
+        fc = extract_s2_pixels(
+            aoi_coords=aoi_coords,
+            start_date=start_date,
+            end_date=end_date,
+            num_pixels=n_pixels
+        )
 
-        df["carbon_class"] = df["carbon_kg"].apply(classify)
+        features = get_info(fc).get("features", [])
+
+    if len(features) == 0:
+        return jsonify({"error": "No vegetation pixels found"}), 400
+
+    df = features_to_frame(features, FEATURES)
+    del features
+
+    if df.empty:
+        return jsonify({"error": "All pixels invalid after filtering"}), 400
+
+    # --------------------------------------------------
+    # Predict carbon
+    # --------------------------------------------------
+    carbon = registry.predict(df[FEATURES].values)
+
+    # --------------------------------------------------
+    # KPIs (SAFE)
+    # --------------------------------------------------
+    mean_carbon = carbon.mean()
+    std_carbon = carbon.std(ddof=1)
+
+    confidence = round(confidence_from(mean_carbon, std_carbon), 2)
+
+    # --------------------------------------------------
+    # AOI address (cached)
+    # --------------------------------------------------
+    aoi_address = resolve_aoi_address(aoi_coords, lookup=False)
+
+    # --------------------------------------------------
+    # CSV creation
+    # --------------------------------------------------
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    writer.writerow(["# CarboVista — Spatial Tree Carbon Prediction"])
+    writer.writerow([f"# Generated (UTC),{datetime.utcnow()}"])
+    writer.writerow([f"# AOI Location,{aoi_address}"])
+    writer.writerow([f"# AOI Area (km²),{area_km2:.3f}"])
+    writer.writerow([f"# Analysed Pixels,{len(df)}"])
+    writer.writerow([f"# Mean Tree Carbon (kg C),{mean_carbon:.2f}"])
+    writer.writerow([f"# Prediction Confidence,{confidence}"])
+    writer.writerow([])
+
+    writer.writerow([
+        "pixel_id",
+        "latitude",
+        "longitude",
+        "tree_carbon_kg",
+        "carbon_class"
+    ])
+
+    # Column-wise rows (no per-row Series like iterrows)
+    writer.writerows(zip(
+        (df.index + 1).tolist(),
+        df["lat"].round(6).tolist(),
+        df["lon"].round(6).tolist(),
+        np.round(carbon, 2).tolist(),
+        map(classify_carbon, carbon.tolist())
+    ))
+
+    return Response(
+        output.getvalue(),
+        mimetype="text/csv",
+        headers={
+            "Content-Disposition":
+            "attachment; filename=carbovista_pixel_predictions.csv"
+        }
+    )
 
-        # --------------------------------------------------
-        # KPIs (SAFE)
-        # --------------------------------------------------
-        mean_carbon = df["carbon_kg"].mean()
-        std_carbon = df["carbon_kg"].std()
 
-        if mean_carbon > 0:
-            confidence = float(np.exp(-std_carbon / mean_carbon))
-        else:
-            confidence = 0.0
+@app.route("/download-csv", methods=["POST"])
+def download_csv():
+    try:
+        payload = request.get_json()
+        aoi_coords = payload.get("aoi")
+        start_date = payload.get("start_date")
+        end_date = payload.get("end_date")
 
-        confidence = round(max(0.0, min(confidence, 1.0)), 2)
+        if not aoi_coords or not start_date or not end_date:
+            return jsonify({"error": "Missing AOI or date range"}), 400
 
         # --------------------------------------------------
-        # AOI address (cached)
+        # AOI size enforcement (same as /run-analysis)
         # --------------------------------------------------
-        aoi_address = "Unknown location"
-        aoi_key = aoi_hash(aoi_coords)
+        area_km2 = compute_aoi_area_km2(aoi_coords)
 
-        if aoi_key and aoi_key in AOI_ADDRESS_CACHE:
-            aoi_address = AOI_ADDRESS_CACHE[aoi_key]
+        error = aoi_area_error(area_km2)
+        if error:
+            return error
 
-        # --------------------------------------------------
-        # CSV creation
-        # --------------------------------------------------
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        writer.writerow(["# CarboVista — Spatial Tree Carbon Prediction"])
-        writer.writerow([f"# Generated (UTC),{datetime.utcnow()}"])
-        writer.writerow([f"# AOI Location,{aoi_address}"])
-        writer.writerow([f"# AOI Area (km²),{area_km2:.3f}"])
-        writer.writerow([f"# Analysed Pixels,{len(df)}"])
-        writer.writerow([f"# Mean Tree Carbon (kg C),{mean_carbon:.2f}"])
-        writer.writerow([f"# Prediction Confidence,{confidence}"])
-        writer.writerow([])
-
-        writer.writerow([
-            "pixel_id",
-            "latitude",
-            "longitude",
-            "tree_carbon_kg",
-            "carbon_class"
-        ])
+        with admission.admit(requested_pixels(area_km2), "csv") as n_pixels:
+            return build_csv_response(
+                aoi_coords, start_date, end_date, area_km2, n_pixels
+            )
 
-        for i, r in df.iterrows():
-            writer.writerow([
-                i + 1,
-                round(r["lat"], 6),
-                round(r["lon"], 6),
-                round(r["carbon_kg"], 2),
-                r["carbon_class"]
-            ])
+    except AdmissionRejected as e:
+        return admission_response(e)
 
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={
-                "Content-Disposition":
-                "attachment; filename=carbovista_pixel_predictions.csv"
-            }
-        )
+    except EEQuotaError as e:
+        return ee_busy_response(e)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
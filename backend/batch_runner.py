@@ -0,0 +1,339 @@
+# batch_runner.py
+"""
+Headless batch scoring of many AOIs (no browser, no Flask)
+
+Runs the same extraction → RF inference → KPI logic as /run-analysis
+for every AOI in a GeoJSON or CSV file, in a process pool with a
+shared cap on concurrent Earth Engine calls.
+
+Input
+    GeoJSON  FeatureCollection of Polygons; properties may hold
+             id, start_date, end_date
+    CSV      columns id, start_date, end_date, geometry
+             (geometry = GeoJSON Polygon as JSON text)
+    --start / --end fill in missing dates.
+
+Output (--out)
+    pixels/<id>.parquet   per-pixel features, carbon_kg, carbon_class
+    stats.parquet         one row of dashboard KPIs per AOI
+    checkpoint.jsonl      progress; re-running the same command skips
+                          AOIs that already completed and retries the
+                          ones that failed for transient reasons
+                          (EE quota, network). --retry-failed also
+                          re-runs permanent failures.
+
+Usage (from backend/):
+    python batch_runner.py parcels.geojson --out runs/2025Q1 \
+        --start 2025-01-01 --end 2025-03-31 --workers 4 --ee-concurrency 3
+
+Parquet output needs pyarrow (or fastparquet) installed.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.error import URLError
+
+import pandas as pd
+
+import ee_scheduler
+from analysis_utils import (
+    MAX_AOI_AREA_KM2,
+    compute_aoi_area_km2,
+    estimate_aoi_pixels,
+    features_to_frame,
+    classify_carbon,
+    class_shares,
+    build_stats
+)
+from ee_scheduler import EEQuotaError, get_info, ee_priority, is_quota_error
+from gee_utils import init_ee, extract_s2_pixels, EE_MAX_FEATURES
+from model_registry import active_model_path, load_bundle
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.environ.get("CARBOVISTA_MODEL_DIR", os.path.join(BASE_DIR, "model"))
+
+
+# ------------------------------------------------------------
+# Reading AOIs
+# ------------------------------------------------------------
+def safe_id(value):
+    """AOI id usable as a file name"""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(value)).strip("_") or "aoi"
+
+
+def read_aois(path, default_start=None, default_end=None):
+    jobs = []
+
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = [
+                (r.get("id"), json.loads(r["geometry"]), r)
+                for r in csv.DictReader(f)
+            ]
+    else:
+        with open(path, encoding="utf-8") as f:
+            geojson = json.load(f)
+        rows = [
+            ((feat.get("properties") or {}).get("id", feat.get("id")),
+             feat["geometry"],
+             feat.get("properties") or {})
+            for feat in geojson["features"]
+        ]
+
+    seen = set()
+    for i, (aoi_id, geometry, props) in enumerate(rows, start=1):
+        if geometry["type"] != "Polygon":
+            raise ValueError(f"AOI {aoi_id or i}: only Polygon geometries are supported")
+
+        aoi_id = safe_id(aoi_id if aoi_id not in (None, "") else i)
+        if aoi_id in seen:
+            raise ValueError(f"Duplicate AOI id: {aoi_id}")
+        seen.add(aoi_id)
+
+        start_date = props.get("start_date") or default_start
+        end_date = props.get("end_date") or default_end
+        if not start_date or not end_date:
+            raise ValueError(f"AOI {aoi_id}: missing date range (use --start/--end)")
+
+        jobs.append({
+            "id": aoi_id,
+            "aoi": geometry["coordinates"],
+            "start_date": start_date,
+            "end_date": end_date
+        })
+
+    return jobs
+
+
+# ------------------------------------------------------------
+# Checkpoint
+# ------------------------------------------------------------
+def read_checkpoint(path):
+    """{aoi id: last checkpoint entry}"""
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    done[entry["id"]] = entry
+    return done
+
+
+# Failures that may succeed on the next run (quota, network, EE load)
+TRANSIENT_ERRORS = (EEQuotaError, ConnectionError, TimeoutError, URLError)
+TRANSIENT_MESSAGES = (
+    "timed out",
+    "deadline exceeded",
+    "service unavailable",
+    "internal error",
+    "503"
+)
+
+
+def is_transient(exc):
+    if isinstance(exc, TRANSIENT_ERRORS) or is_quota_error(exc):
+        return True
+    message = str(exc).lower()
+    return any(s in message for s in TRANSIENT_MESSAGES)
+
+
+def failure_entry(aoi_id, exc):
+    return {
+        "id": aoi_id,
+        "status": "failed",
+        "error": str(exc),
+        "error_type": type(exc).__name__,
+        "transient": is_transient(exc)
+    }
+
+
+def is_pending(entry, retry_failed=False):
+    """
+    Whether an AOI still needs a run, given its last checkpoint entry.
+    Transient failures are always retried; permanent ones (bad
+    geometry, no vegetation, …) only with retry_failed. Entries from
+    before failures were classified count as permanent.
+    """
+    if entry is None:
+        return True
+    if entry["status"] == "ok":
+        return False
+    return retry_failed or entry.get("transient", False)
+
+
+def append_checkpoint(path, entry):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ------------------------------------------------------------
+# Worker process
+# ------------------------------------------------------------
+_model = None
+_features = None
+
+
+def init_worker(ee_gate):
+    global _model, _features
+
+    init_ee()
+
+    # All workers share one EE concurrency budget
+    ee_scheduler.scheduler.gate = ee_gate
+
+    # Same model the server is serving (last promoted)
+    bundle = load_bundle(active_model_path(MODEL_DIR))
+    _model = bundle.model
+    _features = bundle.features
+
+
+def score_aoi(job, pixels_dir):
+    """Same steps as /run-analysis. Returns the stats dict."""
+    started = time.perf_counter()
+    area_km2 = compute_aoi_area_km2(job["aoi"])
+
+    if area_km2 > MAX_AOI_AREA_KM2:
+        raise ValueError(
+            f"AOI too large ({area_km2:.2f} km²). "
+            f"Maximum supported area is {MAX_AOI_AREA_KM2} km²."
+        )
+
+    with ee_priority("batch"):
+        fc = extract_s2_pixels(
+            aoi_coords=job["aoi"],
+            start_date=job["start_date"],
+            end_date=job["end_date"],
+            num_pixels=max(1, min(estimate_aoi_pixels(area_km2), EE_MAX_FEATURES))
+        )
+        features = get_info(fc).get("features", [])
+
+    df = features_to_frame(features, _features)
+    if df.empty:
+        raise ValueError("No valid vegetation pixels found")
+
+    df["carbon_kg"] = _model.predict(df[_features].values)
+    df["carbon_class"] = df["carbon_kg"].apply(classify_carbon)
+
+    # Write-then-rename: a crash never leaves a partial pixel table
+    path = os.path.join(pixels_dir, f"{job['id']}.parquet")
+    tmp_path = path + ".tmp"
+    df.reset_index(drop=True).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    classes = df["carbon_class"].value_counts()
+
+    stats = build_stats(
+        df["carbon_kg"].values,
+        area_km2,
+        job["id"],
+        job["start_date"],
+        job["end_date"]
+    )
+    stats["class_shares"] = class_shares(
+        *(int(classes.get(c, 0)) for c in ("Low", "Medium", "High"))
+    )
+    stats["runtime_s"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+# ------------------------------------------------------------
+# Main
+# ------------------------------------------------------------
+def stats_frame(checkpoint):
+    """One row of KPIs per completed AOI (class shares flattened)"""
+    rows = []
+    for aoi_id, entry in checkpoint.items():
+        if entry["status"] != "ok":
+            continue
+        stats = dict(entry["stats"])
+        shares = stats.pop("class_shares", {}) or {}
+        stats.pop("aoi_address", None)
+        rows.append({
+            "id": aoi_id,
+            **stats,
+            **{f"share_{k.lower()}": v for k, v in shares.items()}
+        })
+
+    return pd.DataFrame(rows)
+
+
+def write_stats_table(checkpoint, out_dir):
+    table = stats_frame(checkpoint)
+    if not table.empty:
+        table.to_parquet(os.path.join(out_dir, "stats.parquet"), index=False)
+    return len(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("input", help="GeoJSON or CSV of AOIs")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--start", help="Default start date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Default end date (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument(
+        "--ee-concurrency", type=int, default=3,
+        help="Max EE calls in flight across all workers"
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true",
+        help="Also re-run AOIs that failed permanently "
+             "(transient failures are always retried)"
+    )
+    args = parser.parse_args()
+
+    jobs = read_aois(args.input, args.start, args.end)
+
+    pixels_dir = os.path.join(args.out, "pixels")
+    os.makedirs(pixels_dir, exist_ok=True)
+    checkpoint_path = os.path.join(args.out, "checkpoint.jsonl")
+    checkpoint = read_checkpoint(checkpoint_path)
+
+    todo = [
+        job for job in jobs
+        if is_pending(checkpoint.get(job["id"]), args.retry_failed)
+    ]
+    print(f"🧮 {len(jobs)} AOIs, {len(jobs) - len(todo)} already done, {len(todo)} to run")
+
+    ee_gate = multiprocessing.Semaphore(args.ee_concurrency)
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(ee_gate,)
+    ) as pool:
+        futures = {pool.submit(score_aoi, job, pixels_dir): job for job in todo}
+
+        for n, future in enumerate(as_completed(futures), start=1):
+            job = futures[future]
+            try:
+                entry = {"id": job["id"], "status": "ok", "stats": future.result()}
+                print(f"✅ [{n}/{len(todo)}] {job['id']}")
+            except Exception as e:
+                entry = failure_entry(job["id"], e)
+                kind = "transient" if entry["transient"] else "permanent"
+                print(f"⚠️ [{n}/{len(todo)}] {job['id']} failed ({kind}):", e)
+
+            append_checkpoint(checkpoint_path, entry)
+            checkpoint[job["id"]] = entry
+
+    n_ok = write_stats_table(checkpoint, args.out)
+    failed = [e for e in checkpoint.values() if e["status"] != "ok"]
+    n_transient = sum(1 for e in failed if e.get("transient"))
+    print(
+        f"✅ {n_ok} AOIs in stats.parquet, {len(failed)} failed "
+        f"({n_transient} transient, retried on the next run)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# build_carbon_grid.py
+"""
+Offline build of the precomputed carbon grid (see carbon_grid.py)
+
+Runs the same Sentinel-2 features + RF model as /run-analysis over
+every pixel of fixed tiles and stores float32 carbon rasters with
+summed-area tables.
+
+Usage (from backend/):
+    python build_carbon_grid.py --start 2024-01-01 --end 2024-12-31
+    python build_carbon_grid.py --start 2024-01-01 --end 2024-12-31 \
+        --bbox 101.55 3.0 101.75 3.25        # Kuala Lumpur only
+
+Tiles are built in a process pool; all workers share one cap on
+concurrent Earth Engine calls (--ee-concurrency), as in batch_runner.py.
+A full-country build is ~200k tiles, so throughput is bounded by the
+EE cap: restrict to the cities you need with --bbox first.
+
+Tiles already built for the period with the same model are skipped,
+so an interrupted build can simply be re-run; tiles built with an
+older model are rebuilt.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import carbon_grid
+import ee_scheduler
+from ee_scheduler import ee_priority
+from gee_utils import init_ee, extract_s2_tile, GRID_NODATA
+from model_registry import active_model_path, load_bundle
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.environ.get("CARBOVISTA_MODEL_DIR", os.path.join(BASE_DIR, "model"))
+BOUNDARY_PATH = os.path.join(BASE_DIR, "..", "data", "malaysia_boundary.geojson")
+
+
+# ------------------------------------------------------------
+# Malaysia boundary (tile selection)
+# ------------------------------------------------------------
+def load_boundary_rings():
+    with open(BOUNDARY_PATH) as f:
+        geojson = json.load(f)
+
+    rings = []
+    for feature in geojson["features"]:
+        geom = feature["geometry"]
+        polygons = (
+            geom["coordinates"] if geom["type"] == "MultiPolygon"
+            else [geom["coordinates"]]
+        )
+        for polygon in polygons:
+            rings.append(polygon[0])   # outer rings only
+    return rings
+
+
+def land_tiles(tiles, rings):
+    """
+    Tiles overlapping Malaysia. Uses scanlines at the top, middle and
+    bottom of each tile row, so the boundary is walked once per row
+    rather than once per tile.
+    """
+    by_row = {}
+    for tx, ty in tiles:
+        by_row.setdefault(ty, []).append(tx)
+
+    selected = []
+    for ty, txs in sorted(by_row.items()):
+        _, lat_min, _, lat_max = carbon_grid.tile_bounds(txs[0], ty)
+
+        spans = [
+            span
+            for lat in (lat_min, (lat_min + lat_max) / 2, lat_max)
+            for ring in rings
+            for span in carbon_grid.row_spans(ring, lat)
+        ]
+
+        for tx in txs:
+            lon_min, _, lon_max, _ = carbon_grid.tile_bounds(tx, ty)
+            if any(a <= lon_max and b >= lon_min for a, b in spans):
+                selected.append((tx, ty))
+
+    return selected
+
+
+# ------------------------------------------------------------
+# One tile: EE features → RF → carbon raster
+# ------------------------------------------------------------
+def tile_carbon(model, features, bands):
+    """float32 [T, T] carbon raster from sampleRectangle band arrays"""
+    T = carbon_grid.TILE_CELLS
+
+    # sampleRectangle can return one pixel more/less than the tile
+    stack = np.stack([
+        np.asarray(bands[name], dtype=np.float64)[:T, :T]
+        for name in features
+    ], axis=-1)
+
+    carbon = np.full((T, T), np.nan, dtype=np.float32)
+    rows, cols = stack.shape[:2]
+
+    valid = np.all(stack != GRID_NODATA, axis=-1)
+    if valid.any():
+        carbon[:rows, :cols][valid] = model.predict(stack[valid])
+
+    return carbon
+
+
+# ------------------------------------------------------------
+# Worker process
+# ------------------------------------------------------------
+_bundle = None
+
+
+def init_worker(ee_gate):
+    global _bundle
+
+    init_ee()
+
+    # All workers share one EE concurrency budget
+    ee_scheduler.scheduler.gate = ee_gate
+
+    _bundle = load_bundle(active_model_path(MODEL_DIR))
+
+
+def build_tile(start_date, end_date, tx, ty):
+    # Grid builds never compete with interactive requests
+    with ee_priority("batch"):
+        bands = extract_s2_tile(
+            carbon_grid.tile_bounds(tx, ty),
+            start_date,
+            end_date,
+            carbon_grid.tile_crs_transform(tx, ty)
+        )
+
+    carbon = tile_carbon(_bundle.model, _bundle.features, bands)
+    carbon_grid.save_tile(start_date, end_date, tx, ty, carbon, _bundle.version)
+    return tx, ty
+
+
+# ------------------------------------------------------------
+# Main
+# ------------------------------------------------------------
+INDEX_EVERY = 200      # tiles between index.json updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="YYYY-MM-DD")
+    parser.add_argument(
+        "--bbox", nargs=4, type=float,
+        metavar=("LON_MIN", "LAT_MIN", "LON_MAX", "LAT_MAX"),
+        help="Restrict the build to this extent (default: all of Malaysia)"
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument(
+        "--ee-concurrency", type=int, default=8,
+        help="Max EE calls in flight across all workers"
+    )
+    args = parser.parse_args()
+
+    # Same model the server is serving (last promoted)
+    model_bundle = load_bundle(active_model_path(MODEL_DIR))
+
+    rings = load_boundary_rings()
+
+    if args.bbox:
+        bbox = args.bbox
+    else:
+        lons = [c[0] for ring in rings for c in ring]
+        lats = [c[1] for ring in rings for c in ring]
+        bbox = [min(lons), min(lats), max(lons), max(lats)]
+
+    tiles = land_tiles(carbon_grid.tiles_for_bbox(*bbox), rings)
+
+    built = [
+        (tx, ty) for tx, ty in tiles
+        if carbon_grid.tile_model_version(args.start, args.end, tx, ty)
+        == model_bundle.version
+    ]
+    done = set(built)
+    todo = [t for t in tiles if t not in done]
+
+    print(
+        f"🧱 {len(tiles)} tiles for {args.start} → {args.end} "
+        f"(model {model_bundle.version}): {len(built)} built, {len(todo)} to run"
+    )
+
+    ee_gate = multiprocessing.Semaphore(args.ee_concurrency)
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(ee_gate,)
+    ) as pool:
+        futures = {
+            pool.submit(build_tile, args.start, args.end, tx, ty): (tx, ty)
+            for tx, ty in todo
+        }
+
+        for n, future in enumerate(as_completed(futures), start=1):
+            tx, ty = futures[future]
+            try:
+                built.append(future.result())
+                rate = n / (time.perf_counter() - started)
+                print(f"✅ [{n}/{len(todo)}] tile {tx},{ty} ({rate:.1f} tiles/s)")
+            except Exception as e:
+                print(f"⚠️ [{n}/{len(todo)}] tile {tx},{ty} failed:", e)
+
+            # Keep the index usable if the build is interrupted
+            if n % INDEX_EVERY == 0:
+                carbon_grid.update_index(
+                    args.start, args.end, built, model_bundle.version
+                )
+
+    carbon_grid.update_index(args.start, args.end, built, model_bundle.version)
+    print(f"✅ Grid ready: {len(built)}/{len(tiles)} tiles")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+# carbon_grid.py
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+"""
+Precomputed national carbon grid for CarboVista
+Tiled float32 carbon rasters + summed-area tables (SATs) so AOI
+stats are answered from disk in milliseconds instead of EE + RF
+
+Layout:
+    grid/<start>_<end>/tile_<tx>_<ty>.npz
+        carbon     float32 [T, T]       kg C per 10 m pixel (NaN = no data)
+        sat_sum    float64 [T+1, T+1]   Σ carbon
+        sat_sq     float64 [T+1, T+1]   Σ carbon²
+        sat_count  int32   [T+1, T+1]   valid (vegetation) pixels
+        sat_class  int32   [3, T+1, T+1] Low / Medium / High pixel counts
+        row_min / row_max  float32 [T]  per-row extrema (±inf = no data)
+        model_version  str               ModelBundle.version used to build it
+"""
+
+# =========================================================
+# 1. GRID DEFINITION (covers data/malaysia_boundary.geojson)
+# =========================================================
+GRID_LON0 = 99.6           # west edge
+GRID_LAT0 = 7.4            # north edge (row 0 = north)
+CELL_DEG = 10 / 111_320    # ≈ 10 m Sentinel-2 pixel
+TILE_CELLS = 128           # 128 × 128 pixels ≈ 1.3 km tiles
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GRID_DIR = os.environ.get("CARBOVISTA_GRID_DIR", os.path.join(BASE_DIR, "grid"))
+
+CLASS_NAMES = ["Low", "Medium", "High"]
+
+
+def period_key(start_date, end_date):
+    return f"{start_date}_{end_date}"
+
+
+def tile_bounds(tx, ty):
+    """[lon_min, lat_min, lon_max, lat_max] of a tile"""
+    lon_min = GRID_LON0 + tx * TILE_CELLS * CELL_DEG
+    lat_max = GRID_LAT0 - ty * TILE_CELLS * CELL_DEG
+    return [
+        lon_min,
+        lat_max - TILE_CELLS * CELL_DEG,
+        lon_min + TILE_CELLS * CELL_DEG,
+        lat_max
+    ]
+
+
+def tile_crs_transform(tx, ty):
+    """EE crsTransform whose pixel grid matches this tile exactly"""
+    lon_min, _, _, lat_max = tile_bounds(tx, ty)
+    return [CELL_DEG, 0, lon_min, 0, -CELL_DEG, lat_max]
+
+
+def tiles_for_bbox(lon_min, lat_min, lon_max, lat_max):
+    tx0 = int(math.floor((lon_min - GRID_LON0) / (TILE_CELLS * CELL_DEG)))
+    tx1 = int(math.floor((lon_max - GRID_LON0) / (TILE_CELLS * CELL_DEG)))
+    ty0 = int(math.floor((GRID_LAT0 - lat_max) / (TILE_CELLS * CELL_DEG)))
+    ty1 = int(math.floor((GRID_LAT0 - lat_min) / (TILE_CELLS * CELL_DEG)))
+    return [
+        (tx, ty)
+        for ty in range(max(ty0, 0), ty1 + 1)
+        for tx in range(max(tx0, 0), tx1 + 1)
+    ]
+
+
+def tile_path(start_date, end_date, tx, ty):
+    return os.path.join(
+        GRID_DIR, period_key(start_date, end_date), f"tile_{tx}_{ty}.npz"
+    )
+
+
+# =========================================================
+# 2. BUILDING TILES
+# =========================================================
+def summed_area(layer):
+    """Zero-padded 2-D prefix sum: S[r, c] = Σ layer[:r, :c]"""
+    sat = np.zeros(
+        (layer.shape[0] + 1, layer.shape[1] + 1),
+        dtype=np.int32 if layer.dtype.kind in "iub" else np.float64
+    )
+    sat[1:, 1:] = layer.cumsum(axis=0).cumsum(axis=1)
+    return sat
+
+
+def row_extrema(carbon):
+    """Per-row min / max of a carbon raster, ±inf for empty rows"""
+    valid = ~np.isnan(carbon)
+    return {
+        "row_min": np.where(valid, carbon, np.inf).min(axis=1).astype(np.float32),
+        "row_max": np.where(valid, carbon, -np.inf).max(axis=1).astype(np.float32)
+    }
+
+
+def build_tile_layers(carbon):
+    """SAT layers for one float32 carbon raster (NaN = no data)"""
+    valid = ~np.isnan(carbon)
+    values = np.where(valid, carbon, 0.0).astype(np.float64)
+
+    classes = np.stack([
+        valid & (values < 30),
+        valid & (values >= 30) & (values < 60),
+        valid & (values >= 60)
+    ]).astype(np.int32)
+
+    return {
+        "carbon": carbon.astype(np.float32),
+        **row_extrema(carbon),
+        "sat_sum": summed_area(values),
+        "sat_sq": summed_area(values ** 2),
+        "sat_count": summed_area(valid.astype(np.int32)),
+        "sat_class": np.stack([summed_area(c) for c in classes])
+    }
+
+
+def save_tile(start_date, end_date, tx, ty, carbon, model_version):
+    path = tile_path(start_date, end_date, tx, ty)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write-then-rename so a half-written tile is never served
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        model_version=np.array(model_version),
+        **build_tile_layers(carbon)
+    )
+    os.replace(tmp_path, path)
+
+
+def tile_model_version(start_date, end_date, tx, ty):
+    """Model version a stored tile was built with (None if missing)"""
+    path = tile_path(start_date, end_date, tx, ty)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if "model_version" not in data.files:
+            return None
+        return str(data["model_version"])
+
+
+def update_index(start_date, end_date, tiles, model_version):
+    """grid/index.json lists built periods, their tiles and model"""
+    index_path = os.path.join(GRID_DIR, "index.json")
+    index = {"periods": {}}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    key = period_key(start_date, end_date)
+    built = {tuple(t) for t in index["periods"].get(key, [])}
+    built.update(tiles)
+    index["periods"][key] = sorted(built)
+    index.setdefault("model_versions", {})[key] = model_version
+    index["grid"] = {
+        "lon0": GRID_LON0,
+        "lat0": GRID_LAT0,
+        "cell_deg": CELL_DEG,
+        "tile_cells": TILE_CELLS
+    }
+
+    os.makedirs(GRID_DIR, exist_ok=True)
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+
+
+# =========================================================
+# 3. TILE CACHE
+# =========================================================
+_TILE_CACHE = {}
+_TILE_LOCK = threading.Lock()
+MAX_CACHED_TILES = 256
+
+
+def load_tile(start_date, end_date, tx, ty):
+    """
+    Tile layers, or None if the tile was never built for this period.
+    Cached by file mtime, so tiles rebuilt by build_carbon_grid.py are
+    picked up without a restart.
+    """
+    key = (start_date, end_date, tx, ty)
+    path = tile_path(start_date, end_date, tx, ty)
+
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _TILE_LOCK:
+        cached = _TILE_CACHE.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    with np.load(path) as data:
+        tile = {name: data[name] for name in data.files}
+    tile["model_version"] = (
+        str(tile["model_version"]) if "model_version" in tile else None
+    )
+    if "row_min" not in tile:       # tiles built before row extrema
+        tile.update(row_extrema(tile["carbon"]))
+
+    with _TILE_LOCK:
+        _TILE_CACHE.pop(key, None)
+        if len(_TILE_CACHE) >= MAX_CACHED_TILES:
+            _TILE_CACHE.pop(next(iter(_TILE_CACHE)))
+        _TILE_CACHE[key] = (mtime, tile)
+
+    return tile
+
+
+# =========================================================
+# 4. AOI QUERY (scanline over SATs)
+# =========================================================
+def row_spans(ring, lat):
+    """Lon intervals where the horizontal line at lat is inside ring"""
+    xs = []
+    n = len(ring)
+    for i in range(n):
+        x1, y1 = ring[i][:2]
+        x2, y2 = ring[(i + 1) % n][:2]
+        if (y1 <= lat < y2) or (y2 <= lat < y1):
+            xs.append(x1 + (lat - y1) * (x2 - x1) / (y2 - y1))
+    xs.sort()
+    return list(zip(xs[0::2], xs[1::2]))
+
+
+def _rect_sum(sat, r0, r1, c0, c1):
+    """Σ over rows [r0, r1) and cols [c0, c1) of the source layer"""
+    return sat[..., r1, c1] - sat[..., r0, c1] - sat[..., r1, c0] + sat[..., r0, c0]
+
+
+def query_aoi(aoi_coords, start_date, end_date, model_version=None):
+    """
+    Carbon moments for an AOI from the grid.
+
+    A pixel belongs to the AOI when its centre lies inside the outer
+    ring. Returns None when any tile touched by the AOI is missing
+    for this period, or was built with a model other than
+    model_version (caller falls back to the live EE path).
+    """
+    ring = aoi_coords[0]
+    lons = [c[0] for c in ring]
+    lats = [c[1] for c in ring]
+
+    bbox_tiles = tiles_for_bbox(min(lons), min(lats), max(lons), max(lats))
+    if not all(
+        os.path.exists(tile_path(start_date, end_date, tx, ty))
+        for tx, ty in bbox_tiles
+    ):
+        return None
+
+    tile_rows = {}
+    for tx, ty in bbox_tiles:
+        tile_rows.setdefault(ty, []).append(tx)
+
+    row0 = int(math.floor((GRID_LAT0 - max(lats)) / CELL_DEG))
+    row1 = int(math.floor((GRID_LAT0 - min(lats)) / CELL_DEG))
+
+    total = 0.0
+    total_sq = 0.0
+    count = 0
+    class_counts = np.zeros(3, dtype=np.int64)
+    min_c, max_c = np.inf, -np.inf
+
+    # One row of tiles at a time, so memory is bounded by the AOI
+    # width rather than its area
+    for ty, txs in sorted(tile_rows.items()):
+        tiles = {}
+        for tx in txs:
+            tile = load_tile(start_date, end_date, tx, ty)
+            if tile is None:
+                return None
+            if model_version is not None and tile["model_version"] != model_version:
+                return None
+            tiles[tx] = tile
+
+        band_rows = range(
+            max(row0, ty * TILE_CELLS, 0),
+            min(row1, (ty + 1) * TILE_CELLS - 1) + 1
+        )
+
+        for row in band_rows:
+            lat_c = GRID_LAT0 - (row + 0.5) * CELL_DEG
+            r = row - ty * TILE_CELLS
+
+            for x_a, x_b in row_spans(ring, lat_c):
+                # Columns whose centre falls inside [x_a, x_b]
+                col_a = int(math.ceil((x_a - GRID_LON0) / CELL_DEG - 0.5))
+                col_b = int(math.floor((x_b - GRID_LON0) / CELL_DEG - 0.5))
+
+                col = max(col_a, 0)
+                while col <= col_b:
+                    tx, c0 = divmod(col, TILE_CELLS)
+                    c1 = min(TILE_CELLS, c0 + (col_b - col) + 1)
+                    tile = tiles[tx]
+
+                    n = int(_rect_sum(tile["sat_count"], r, r + 1, c0, c1))
+                    if n:
+                        count += n
+                        total += float(_rect_sum(tile["sat_sum"], r, r + 1, c0, c1))
+                        total_sq += float(_rect_sum(tile["sat_sq"], r, r + 1, c0, c1))
+                        class_counts += _rect_sum(tile["sat_class"], r, r + 1, c0, c1)
+
+                        if c0 == 0 and c1 == TILE_CELLS:
+                            # Whole tile row → stored extrema
+                            min_c = min(min_c, float(tile["row_min"][r]))
+                            max_c = max(max_c, float(tile["row_max"][r]))
+                        else:
+                            span = tile["carbon"][r, c0:c1]
+                            min_c = min(min_c, float(np.nanmin(span)))
+                            max_c = max(max_c, float(np.nanmax(span)))
+
+                    col += c1 - c0
+
+    if count == 0:
+        return {"n_pixels": 0}
+
+    mean = total / count
+    var = (total_sq - count * mean ** 2) / (count - 1) if count > 1 else 0.0
+
+    return {
+        "n_pixels": count,
+        "total": total,
+        "mean": mean,
+        "std": float(np.sqrt(max(var, 0.0))),
+        "min": min_c,
+        "max": max_c,
+        "class_counts": dict(zip(CLASS_NAMES, class_counts.tolist()))
+    }
@@ -0,0 +1,81 @@
+# ee_cassette.py
+import hashlib
+import json
+import os
+import threading
+
+"""
+Record / replay of Earth Engine responses for load tests
+CARBOVISTA_EE_CASSETTE=/path/ee.jsonl with CARBOVISTA_EE_MODE:
+  record → every getInfo() result is appended, keyed by the
+           serialized EE computation
+  replay → results are served from the file; no getInfo() reaches EE
+Keeps replayed load tests independent of EE compute quota and latency.
+The server still runs init_ee() in both modes: building and
+serializing computations needs the EE API definitions, so EE
+credentials and network access are still required.
+
+Only keys and file offsets are kept in memory; results (several MB
+per pixel request) live in the file.
+"""
+
+
+class CassetteMiss(KeyError):
+    """Replay mode hit a computation that was never recorded"""
+
+
+class EECassette:
+    def __init__(self, path, mode):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown EE cassette mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._offsets = {}          # key → byte offset of its line
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if line.strip():
+                        key = json.loads(line)["key"]
+                        self._offsets.setdefault(key, offset)
+                    offset += len(line)
+
+    @staticmethod
+    def key_for(ee_obj):
+        return hashlib.sha256(ee_obj.serialize().encode("utf-8")).hexdigest()
+
+    def _read(self, offset):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())["result"]
+
+    def get_info(self, ee_obj, call):
+        """call() performs the real (scheduled) getInfo in record mode"""
+        key = self.key_for(ee_obj)
+
+        if self.mode == "replay":
+            offset = self._offsets.get(key)
+            if offset is None:
+                raise CassetteMiss(
+                    f"No recorded EE response for computation {key[:12]}"
+                )
+            return self._read(offset)
+
+        result = call()
+        with self._lock:
+            if key not in self._offsets:
+                line = (json.dumps({"key": key, "result": result}) + "\n").encode("utf-8")
+                with open(self.path, "ab") as f:
+                    self._offsets[key] = f.tell()
+                    f.write(line)
+        return result
+
+
+def cassette_from_env():
+    path = os.environ.get("CARBOVISTA_EE_CASSETTE")
+    if not path:
+        return None
+    return EECassette(path, os.environ.get("CARBOVISTA_EE_MODE", "replay"))
@@ -0,0 +1,139 @@
+# ee_model_utils.py
+import ee
+
+from ee_scheduler import get_info
+
+"""
+Translates the trained scikit-learn Random Forest into an
+Earth Engine classifier so ACD can be predicted server-side
+(ee.Classifier.decisionTreeEnsemble, REGRESSION mode)
+
+Tree strings follow the EE / R "rpart" text format:
+    1) root 9999 9999 41.2
+      2) NDVI<=0.53 9999 9999 28.7
+        4) B8<=0.21 9999 9999 21.0 *
+        ...
+Node n has children 2n (left, <=) and 2n+1 (right, >); leaves end in " *".
+"""
+
+# =========================================================
+# 1. SKLEARN TREE → EE TREE STRING
+# =========================================================
+def tree_to_string(estimator, feature_names):
+    """Text dump of one fitted DecisionTreeRegressor"""
+    tree = estimator.tree_
+    left = tree.children_left
+    right = tree.children_right
+
+    def value(node):
+        return f"{float(tree.value[node].ravel()[0]):.6f}"
+
+    root_is_leaf = left[0] == right[0]
+    lines = [
+        f"1) root {int(tree.n_node_samples[0])} 9999 {value(0)}"
+        f"{' *' if root_is_leaf else ''}"
+    ]
+
+    # Pre-order walk: (sklearn node, EE node id, depth, split text)
+    stack = []
+    if not root_is_leaf:
+        name = feature_names[tree.feature[0]]
+        threshold = f"{float(tree.threshold[0]):.8f}"
+        stack = [
+            (right[0], 3, 1, f"{name}>{threshold}"),
+            (left[0], 2, 1, f"{name}<={threshold}")
+        ]
+
+    while stack:
+        node, node_id, depth, split = stack.pop()
+        is_leaf = left[node] == right[node]
+
+        lines.append(
+            f"{'  ' * depth}{node_id}) {split} "
+            f"{int(tree.n_node_samples[node])} 9999 {value(node)}"
+            f"{' *' if is_leaf else ''}"
+        )
+
+        if not is_leaf:
+            name = feature_names[tree.feature[node]]
+            threshold = f"{float(tree.threshold[node]):.8f}"
+            stack.append((right[node], node_id * 2 + 1, depth + 1, f"{name}>{threshold}"))
+            stack.append((left[node], node_id * 2, depth + 1, f"{name}<={threshold}"))
+
+    return "\n".join(lines)
+
+
+def forest_to_strings(model, feature_names):
+    return [tree_to_string(t, feature_names) for t in model.estimators_]
+
+
+# =========================================================
+# 2. EE CLASSIFIER
+# =========================================================
+class InlineTreesTooLarge(ValueError):
+    """Inline tree strings would exceed the EE request size limit"""
+
+
+def forest_to_ee_classifier(
+    model,
+    feature_names,
+    asset_id=None,
+    max_inline_bytes=None
+):
+    """
+    EE regression classifier equivalent to the sklearn forest.
+
+    Inline tree strings are sent with every request, which can exceed
+    EE's request size for large forests. Pass asset_id (exported with
+    export_forest_to_asset) to reference stored trees instead.
+    Without an asset, raises InlineTreesTooLarge when the strings
+    exceed max_inline_bytes.
+    """
+    if asset_id:
+        trees = ee.FeatureCollection(asset_id).aggregate_array("tree").map(
+            lambda t: ee.String(t).replace("#", "\n", "g")
+        )
+    else:
+        trees = forest_to_strings(model, feature_names)
+        size = sum(len(t) for t in trees)
+        if max_inline_bytes is not None and size > max_inline_bytes:
+            raise InlineTreesTooLarge(
+                f"Model trees are {size / 2**20:.1f} MB inline "
+                f"(limit {max_inline_bytes / 2**20:.1f} MB)"
+            )
+
+    return (
+        ee.Classifier.decisionTreeEnsemble(trees)
+        .setOutputMode("REGRESSION")
+    )
+
+
+def export_forest_to_asset(model, feature_names, asset_id, model_version=None):
+    """
+    Stores tree strings as a FeatureCollection asset (one feature
+    per tree, newlines encoded as "#"). Every feature also carries
+    model_version (see asset_model_version). Returns the started task.
+    """
+    fc = ee.FeatureCollection([
+        ee.Feature(None, {
+            "tree": s.replace("\n", "#"),
+            "model_version": model_version or ""
+        })
+        for s in forest_to_strings(model, feature_names)
+    ])
+
+    task = ee.batch.Export.table.toAsset(
+        collection=fc,
+        description="carbovista_rf_trees",
+        assetId=asset_id
+    )
+    task.start()
+    return task
+
+
+def asset_model_version(asset_id):
+    """model_version recorded by export_forest_to_asset (None if absent)"""
+    version = get_info(
+        ee.FeatureCollection(asset_id).first().get("model_version")
+    )
+    return version or None
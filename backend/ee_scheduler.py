@@ -0,0 +1,314 @@
+# ee_scheduler.py
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from ee_cassette import cassette_from_env
+
+"""
+Central Earth Engine dispatcher for CarboVista
+Every getInfo() goes through here so the server stays inside
+EE concurrency / quota limits under load:
+  - concurrency cap
+  - token-bucket rate limit
+  - priority classes (interactive > export > batch)
+  - jittered exponential retry on quota errors
+  - bounded queue (depth + wait) → EEQuotaError → 503
+  - queue-depth metrics (/ee-metrics)
+"""
+
+# =========================================================
+# 1. CONFIGURATION
+# =========================================================
+PRIORITIES = {
+    "interactive": 0,   # /run-analysis, streaming, dashboard stats
+    "export": 1,        # CSV downloads
+    "batch": 2          # offline grid builds / batch runs
+}
+
+# Substrings of EE errors that are worth retrying
+RETRYABLE_ERRORS = (
+    "too many concurrent",
+    "quota",
+    "rate limit",
+    "too many requests",
+    "429"
+)
+
+
+class EEQuotaError(RuntimeError):
+    """EE kept rejecting the call for quota reasons after all retries"""
+
+
+def is_quota_error(exc):
+    message = str(exc).lower()
+    return any(s in message for s in RETRYABLE_ERRORS)
+
+
+# =========================================================
+# 2. TOKEN BUCKET
+# =========================================================
+class TokenBucket:
+    def __init__(self, rate_per_sec, burst):
+        if not rate_per_sec > 0:
+            raise ValueError(f"EE rate must be > 0 calls/s (got {rate_per_sec})")
+        if not burst >= 1:
+            raise ValueError(f"EE burst must be >= 1 (got {burst})")
+        self.rate = float(rate_per_sec)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until one token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# =========================================================
+# 3. PRIORITY DISPATCHER
+# =========================================================
+class EEScheduler:
+    def __init__(
+        self,
+        max_concurrent=4,
+        rate_per_sec=10,
+        burst=10,
+        max_retries=5,
+        base_delay=0.5,
+        max_delay=30.0,
+        max_queue_depth=100,
+        max_queue_wait_s=60.0
+    ):
+        """
+        max_queue_depth   callers allowed to wait for a slot
+        max_queue_wait_s  longest wait for a slot (None = no limit)
+        Beyond either limit the call fails fast with EEQuotaError.
+        """
+        if max_concurrent < 1:
+            raise ValueError(f"EE max_concurrent must be >= 1 (got {max_concurrent})")
+
+        self.max_concurrent = max_concurrent
+        self.bucket = TokenBucket(rate_per_sec, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait_s = max_queue_wait_s
+
+        # Optional cross-process limit (e.g. multiprocessing.Semaphore
+        # shared by batch_runner workers), held only around the EE call
+        self.gate = None
+
+        self._cond = threading.Condition()
+        self._waiting = []                 # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._in_flight = 0
+
+        self._metrics = {
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "quota_errors": 0,
+            "shed": 0,
+            "total_wait_s": 0.0,
+            "max_wait_s": 0.0
+        }
+
+    # -----------------------------------------------------
+    # Slot handling (highest priority, then FIFO)
+    # -----------------------------------------------------
+    def _shed(self, reason):
+        self._metrics["shed"] += 1
+        return EEQuotaError(
+            f"Earth Engine queue is full ({reason}). Please try again shortly."
+        )
+
+    def _acquire_slot(self, priority):
+        ticket = (PRIORITIES[priority], next(self._seq))
+
+        with self._cond:
+            if len(self._waiting) >= self.max_queue_depth:
+                raise self._shed(f"{len(self._waiting)} calls waiting")
+
+            deadline = (
+                None if self.max_queue_wait_s is None
+                else time.monotonic() + self.max_queue_wait_s
+            )
+
+            heapq.heappush(self._waiting, ticket)
+            while (
+                self._waiting[0] != ticket
+                or self._in_flight >= self.max_concurrent
+            ):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise self._shed(f"waited {self.max_queue_wait_s:g} s")
+                self._cond.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._in_flight += 1
+            self._cond.notify_all()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        # Full jitter keeps retrying requests from re-synchronising
+        return random.uniform(0, delay)
+
+    # -----------------------------------------------------
+    # Public API
+    # -----------------------------------------------------
+    def submit(self, fn, priority="interactive"):
+        """
+        Runs fn() (an EE call) in the caller's thread once a slot
+        and a rate token are available. Quota errors are retried
+        with jittered exponential backoff; other errors propagate.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown EE priority: {priority}")
+
+        queued_at = time.monotonic()
+        attempt = 0
+
+        while True:
+            self._acquire_slot(priority)
+
+            waited = time.monotonic() - queued_at
+            with self._cond:
+                self._metrics["total_wait_s"] += waited
+                self._metrics["max_wait_s"] = max(
+                    self._metrics["max_wait_s"], waited
+                )
+
+            try:
+                self.bucket.acquire()
+                if self.gate is not None:
+                    with self.gate:
+                        result = fn()
+                else:
+                    result = fn()
+
+            except Exception as e:
+                if not is_quota_error(e):
+                    self._record("failed")
+                    raise
+
+                self._record("quota_errors")
+
+                if attempt >= self.max_retries:
+                    self._record("failed")
+                    raise EEQuotaError(
+                        "Earth Engine is busy (quota / concurrency limit). "
+                        "Please try again shortly."
+                    ) from e
+
+            else:
+                self._record("completed")
+                return result
+
+            finally:
+                self._release_slot()
+
+            # Back off OUTSIDE the slot so others can proceed
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+            self._record("retries")
+            queued_at = time.monotonic()
+
+    def _record(self, key):
+        with self._cond:
+            self._metrics[key] += 1
+
+    def metrics(self):
+        with self._cond:
+            depth = {name: 0 for name in PRIORITIES}
+            by_rank = {rank: name for name, rank in PRIORITIES.items()}
+            for rank, _ in self._waiting:
+                depth[by_rank[rank]] += 1
+
+            calls = self._metrics["completed"] + self._metrics["failed"]
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": depth,
+                "queued_total": len(self._waiting),
+                **self._metrics,
+                "avg_wait_s": (
+                    self._metrics["total_wait_s"] / calls if calls else 0.0
+                )
+            }
+
+
+# =========================================================
+# 4. PROCESS-WIDE DISPATCHER + PRIORITY CONTEXT
+# =========================================================
+scheduler = EEScheduler(
+    max_concurrent=int(os.environ.get("EE_MAX_CONCURRENT", 4)),
+    rate_per_sec=float(os.environ.get("EE_RATE_PER_SEC", 10)),
+    burst=int(os.environ.get("EE_BURST", 10)),
+    max_retries=int(os.environ.get("EE_MAX_RETRIES", 5)),
+    max_queue_depth=int(os.environ.get("EE_MAX_QUEUE_DEPTH", 100)),
+    max_queue_wait_s=float(os.environ.get("EE_MAX_QUEUE_WAIT_S", 60))
+)
+
+_context = threading.local()
+
+
+@contextmanager
+def ee_priority(priority):
+    """
+    Sets the EE priority for calls made in this thread, e.g.
+        with ee_priority("export"):
+            fc.getInfo() ...
+    """
+    previous = getattr(_context, "priority", None)
+    _context.priority = priority
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+def current_priority():
+    return getattr(_context, "priority", None) or "interactive"
+
+
+# Recorded EE responses for replayed load tests (see ee_cassette.py)
+cassette = cassette_from_env()
+
+
+def get_info(ee_obj, priority=None):
+    """Scheduled replacement for ee_obj.getInfo()"""
+    def call():
+        return scheduler.submit(ee_obj.getInfo, priority or current_priority())
+
+    if cassette is not None:
+        return cassette.get_info(ee_obj, call)
+    return call()
@@ -1,6 +1,8 @@
 # gee_utils.py
 import ee
 
+from ee_scheduler import get_info
+
 """
 Earth Engine feature extraction for CarboVista
 Matches trained ML model EXACTLY
@@ -82,38 +84,45 @@ def estimate_pixel_count(aoi, scale=10):
 # =========================================================
 # 5. PIXEL-WISE EXTRACTION (SPATIAL DSS)
 # =========================================================
-def extract_s2_pixels(
-    aoi_coords,
-    start_date,
-    end_date,
-    scale=10,
-    ndvi_threshold=0.25
-):
-    """
-    Returns pixel-wise Sentinel-2 features for ML inference
-    Each row = one pixel (geometry included)
-    """
+# getInfo() refuses collections larger than this (EE API limit)
+EE_MAX_FEATURES = 5000
 
-    aoi = ee.Geometry.Polygon(aoi_coords)
 
+def check_pixel_density(aoi, scale=10, max_pixels=None):
+    """
+    Optional pre-flight AOI density check (one extra EE round-trip).
+    Off by default: the routes size num_pixels through admission
+    control instead. Pass max_pixels to refuse AOIs denser than that.
+    """
+    if max_pixels is None:
+        return None
 
-    # ---------------------------------------------------------
-    # 🔒 PRE-FLIGHT AOI DENSITY CHECK
-    # Prevents server crash for large / dense AOIs
-    # ---------------------------------------------------------
     estimated_pixels = estimate_pixel_count(aoi, scale)
 
     # ⚠️ Convert to client-side number ONCE (safe & fast)
-    estimated_pixels = estimated_pixels.getInfo()
+    estimated_pixels = get_info(estimated_pixels)
 
-    # 8000 pixels ≈ upper safe bound for synchronous EE .getInfo()
-    # at 10 m resolution in urban environments
-    if estimated_pixels > 8000:
+    if estimated_pixels > max_pixels:
         raise ValueError(
             f"AOI too dense (~{int(estimated_pixels)} pixels). "
             "Please reduce AOI size or shorten the date range."
         )
 
+    return estimated_pixels
+
+
+def build_s2_composite(
+    aoi,
+    start_date,
+    end_date,
+    scale=10,
+    ndvi_threshold=0.25,
+    crs_transform=None
+):
+    """
+    Vegetation-masked Sentinel-2 median composite (model bands only)
+    crs_transform pins the pixel grid (used by the precomputed grid)
+    """
     s2 = (
         ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
         .filterDate(start_date, end_date)
@@ -129,7 +138,38 @@ def extract_s2_pixels(
             "B2","B3","B4","B8","B11","B12",
             "GNDVI","VARI","BSI","NDBI","NBR","NDVI"
         ])
-        .reproject(crs="EPSG:4326", scale=scale)
+    )
+
+    if crs_transform is not None:
+        return composite.reproject(crs="EPSG:4326", crsTransform=crs_transform)
+
+    return composite.reproject(crs="EPSG:4326", scale=scale)
+
+
+def extract_s2_pixels(
+    aoi_coords,
+    start_date,
+    end_date,
+    scale=10,
+    ndvi_threshold=0.25,
+    num_pixels=EE_MAX_FEATURES,
+    max_pixels=None
+):
+    """
+    Returns pixel-wise Sentinel-2 features for ML inference
+    Each row = one pixel (geometry included)
+    """
+
+    aoi = ee.Geometry.Polygon(aoi_coords)
+
+
+    # ---------------------------------------------------------
+    # 🔒 PRE-FLIGHT AOI DENSITY CHECK
+    # ---------------------------------------------------------
+    check_pixel_density(aoi, scale, max_pixels)
+
+    composite = build_s2_composite(
+        aoi, start_date, end_date, scale, ndvi_threshold
     )
 
     # ---------------------------------------------------------
@@ -139,7 +179,7 @@ def extract_s2_pixels(
         region=aoi,
         scale=scale,
         geometries=True,
-        numPixels=5000,   # 🔒 Absolute maximum pixels returned
+        numPixels=min(num_pixels, EE_MAX_FEATURES),   # 🔒 Maximum pixels returned
         tileScale=4       # 🔧 Prevents EE memory overflow
     )
 
@@ -148,6 +188,298 @@ def extract_s2_pixels(
     return samples
 
 
+# =========================================================
+# 5.5 CHUNKED PIXEL EXTRACTION (STREAMING)
+# =========================================================
+def _ring_area(ring):
+    """Shoelace area of a lon/lat ring (degree² — only used as a ratio)"""
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2.0
+
+
+def _clip_ring_to_lat_band(ring, lat_min, lat_max):
+    """Sutherland–Hodgman clip of a ring against lat_min <= y <= lat_max"""
+
+    def clip(points, inside, intersect):
+        out = []
+        for i, cur in enumerate(points):
+            prev = points[i - 1]
+            if inside(cur):
+                if not inside(prev):
+                    out.append(intersect(prev, cur))
+                out.append(cur)
+            elif inside(prev):
+                out.append(intersect(prev, cur))
+        return out
+
+    def at_lat(y):
+        def intersect(p, q):
+            t = (y - p[1]) / (q[1] - p[1])
+            return (p[0] + t * (q[0] - p[0]), y)
+        return intersect
+
+    points = [tuple(c[:2]) for c in ring]
+    if len(points) > 1 and points[0] == points[-1]:
+        points = points[:-1]
+
+    points = clip(points, lambda p: p[1] >= lat_min, at_lat(lat_min))
+    if points:
+        points = clip(points, lambda p: p[1] <= lat_max, at_lat(lat_max))
+    return points
+
+
+def lat_band_shares(aoi_coords, n_chunks=4):
+    """
+    Equal-height latitude bands of the AOI and each band's share of
+    the AOI area: [(chunk_index, lat_lo, lat_hi, share), ...].
+    Bands that miss the polygon are left out.
+    """
+    ring = aoi_coords[0]
+    lats = [c[1] for c in ring]
+    lat_min, lat_max = min(lats), max(lats)
+    total_area = _ring_area(_clip_ring_to_lat_band(ring, lat_min, lat_max))
+    if total_area == 0:
+        return []
+
+    band_height = (lat_max - lat_min) / n_chunks
+
+    bands = []
+    for i in range(n_chunks):
+        lo = lat_min + i * band_height
+        hi = lat_max if i == n_chunks - 1 else lo + band_height
+
+        band = _clip_ring_to_lat_band(ring, lo, hi)
+        if len(band) < 3:
+            continue
+
+        bands.append((i, lo, hi, _ring_area(band) / total_area))
+
+    return bands
+
+
+def extract_s2_pixel_chunks(
+    aoi_coords,
+    start_date,
+    end_date,
+    n_chunks=4,
+    scale=10,
+    ndvi_threshold=0.25,
+    num_pixels=EE_MAX_FEATURES,
+    max_pixels=None
+):
+    """
+    Generator version of extract_s2_pixels for progressive responses.
+
+    The AOI is cut into horizontal latitude bands and each band is
+    sampled separately, so results can be sent as soon as a band
+    completes. The num_pixels cap is shared between bands in
+    proportion to their area, keeping the overall sampling density
+    the same as the single-request path.
+
+    Yields (chunk_index, n_chunks, FeatureCollection).
+    """
+
+    aoi = ee.Geometry.Polygon(aoi_coords)
+    check_pixel_density(aoi, scale, max_pixels)
+
+    composite = build_s2_composite(
+        aoi, start_date, end_date, scale, ndvi_threshold
+    )
+
+    ring = aoi_coords[0]
+
+    for i, lo, hi, share in lat_band_shares(aoi_coords, n_chunks):
+        band_pixels = max(1, int(round(num_pixels * share)))
+
+        region = aoi.intersection(
+            ee.Geometry.Rectangle([min(c[0] for c in ring), lo,
+                                   max(c[0] for c in ring), hi]),
+            maxError=1
+        )
+
+        samples = composite.sample(
+            region=region,
+            scale=scale,
+            geometries=True,
+            numPixels=band_pixels,
+            tileScale=4
+        )
+
+        yield i, n_chunks, samples
+
+
+# =========================================================
+# 5.6 NDVI-STRATIFIED SAMPLING (ADAPTIVE MODE)
+# =========================================================
+# Lower NDVI edges of each stratum (vegetation mask starts at 0.25)
+NDVI_STRATA_EDGES = [0.25, 0.4, 0.55, 0.7]
+
+
+def add_ndvi_strata(composite, edges=NDVI_STRATA_EDGES):
+    """
+    Adds an integer "stratum" band: 0 for edges[0] <= NDVI < edges[1], ...
+    """
+    ndvi = composite.select("NDVI")
+    stratum = ee.Image.constant(0)
+    for i, edge in enumerate(edges[1:], start=1):
+        stratum = stratum.where(ndvi.gte(edge), i)
+
+    stratum = stratum.updateMask(ndvi.mask()).rename("stratum").toInt()
+    return composite.addBands(stratum)
+
+
+def prepare_stratified_sampling(
+    aoi_coords,
+    start_date,
+    end_date,
+    scale=10,
+    ndvi_threshold=0.25,
+    edges=NDVI_STRATA_EDGES,
+    max_pixels=None
+):
+    """
+    Builds the stratified composite and counts vegetation pixels
+    per NDVI stratum (one EE round-trip).
+
+    Returns (aoi, composite, {stratum: pixel_count}).
+    """
+    aoi = ee.Geometry.Polygon(aoi_coords)
+    check_pixel_density(aoi, scale, max_pixels)
+
+    composite = add_ndvi_strata(
+        build_s2_composite(aoi, start_date, end_date, scale, ndvi_threshold),
+        edges
+    )
+
+    histogram = get_info(composite.select("stratum").reduceRegion(
+        reducer=ee.Reducer.frequencyHistogram(),
+        geometry=aoi,
+        scale=scale,
+        maxPixels=1e9,
+        tileScale=4
+    ).get("stratum")) or {}
+
+    counts = {int(float(k)): int(v) for k, v in histogram.items()}
+    return aoi, composite, counts
+
+
+def sample_strata(aoi, composite, allocation, seed, scale=10):
+    """
+    Draws allocation[stratum] pixels from each stratum.
+    Each round uses a different seed so rounds add new pixels.
+    """
+    strata = [h for h, n in allocation.items() if n > 0]
+
+    return composite.stratifiedSample(
+        numPoints=0,
+        classBand="stratum",
+        region=aoi,
+        scale=scale,
+        seed=seed,
+        classValues=strata,
+        classPoints=[int(allocation[h]) for h in strata],
+        geometries=True,
+        tileScale=4
+    )
+
+
+# =========================================================
+# 5.7 FULL-RESOLUTION TILE EXTRACTION (PRECOMPUTED GRID)
+# =========================================================
+GRID_NODATA = -9999
+
+
+def extract_s2_tile(
+    bounds,
+    start_date,
+    end_date,
+    crs_transform,
+    ndvi_threshold=0.25
+):
+    """
+    Every pixel of a grid tile as 2-D band arrays (no sampling).
+    bounds = [lon_min, lat_min, lon_max, lat_max]
+    Masked (non-vegetation / cloudy) pixels hold GRID_NODATA.
+
+    Returns {band: [[row values north → south], ...]}
+    """
+    rect = ee.Geometry.Rectangle(bounds, proj="EPSG:4326", geodesic=False)
+
+    composite = build_s2_composite(
+        rect,
+        start_date,
+        end_date,
+        ndvi_threshold=ndvi_threshold,
+        crs_transform=crs_transform
+    )
+
+    tile = composite.sampleRectangle(region=rect, defaultValue=GRID_NODATA)
+    return get_info(tile.toDictionary())
+
+
+# =========================================================
+# 5.8 SERVER-SIDE INFERENCE + STATS (NO PIXEL TRANSFER)
+# =========================================================
+def aoi_carbon_stats_ee(
+    aoi_coords,
+    start_date,
+    end_date,
+    classifier,
+    feature_names,
+    scale=10,
+    ndvi_threshold=0.25
+):
+    """
+    Applies the EE-translated RF to EVERY vegetation pixel in the AOI
+    and reduces in one round-trip. No sampling, no pixel download.
+
+    Returns {"moments": {carbon_kg_mean, _stdDev, _min, _max, _count},
+             "classes": {"0": n_low, "1": n_medium, "2": n_high}}
+    """
+    aoi = ee.Geometry.Polygon(aoi_coords)
+
+    composite = build_s2_composite(
+        aoi, start_date, end_date, scale, ndvi_threshold
+    )
+
+    carbon = (
+        composite.select(feature_names)
+        .classify(classifier)
+        .rename("carbon_kg")
+    )
+
+    # Same thresholds as classify_carbon (Low < 30 ≤ Medium < 60 ≤ High)
+    carbon_class = (
+        carbon.gte(30).add(carbon.gte(60))
+        .rename("carbon_class")
+    )
+
+    moments = carbon.reduceRegion(
+        reducer=(
+            ee.Reducer.mean()
+            .combine(ee.Reducer.stdDev(), sharedInputs=True)
+            .combine(ee.Reducer.minMax(), sharedInputs=True)
+            .combine(ee.Reducer.count(), sharedInputs=True)
+        ),
+        geometry=aoi,
+        scale=scale,
+        maxPixels=1e9,
+        tileScale=4
+    )
+
+    classes = carbon_class.reduceRegion(
+        reducer=ee.Reducer.frequencyHistogram(),
+        geometry=aoi,
+        scale=scale,
+        maxPixels=1e9,
+        tileScale=4
+    ).get("carbon_class")
+
+    return get_info(ee.Dictionary({"moments": moments, "classes": classes}))
+
+
 # =========================================================
 # 6. AOI MEAN FEATURES (DEBUG / BASELINE)
 # =========================================================
@@ -178,4 +510,4 @@ def extract_s2_features(aoi_coords, start_date, end_date):
         maxPixels=1e9
     )
 
-    return stats.getInfo()
\ No newline at end of file
+    return get_info(stats)
\ No newline at end of file
@@ -0,0 +1,437 @@
+# model_registry.py
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+"""
+Model registry for CarboVista
+Watches the model directory and hot-swaps the RF bundle without a
+restart:
+  1. load the newest *.joblib in the background
+  2. validate that FEATURES match the serving model
+  3. warm up on a reference batch
+  4. (optional) shadow-score a fraction of live traffic
+  5. atomically swap the active predictor
+"""
+
+# =========================================================
+# 1. LOADED BUNDLE
+# =========================================================
+class ModelBundle:
+    def __init__(self, path, model, features, sha256=None):
+        self.path = path
+        self.model = model
+        self.features = list(features)
+        self.mtime = os.path.getmtime(path)
+        self.sha256 = sha256 or file_sha256(path)
+        self.loaded_at = time.time()
+        self.warmup_ms = None
+
+    @property
+    def version(self):
+        # Content hash: survives copies, redeploys and touch, so grid
+        # tiles and EE assets tagged with it stay valid
+        return self.sha256[:12]
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "sha256": self.sha256,
+            "path": self.path,
+            "n_features": len(self.features),
+            "loaded_at": self.loaded_at,
+            "warmup_ms": self.warmup_ms
+        }
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_bundle(path, sha256=None):
+    bundle = joblib.load(path)
+    return ModelBundle(path, bundle["model"], bundle["features"], sha256)
+
+
+# Last promoted model, so a restart does not undo a hot-swap
+ACTIVE_FILE = "active.json"
+
+
+def active_model_path(model_dir, default_name="acd_model.joblib"):
+    """Path of the last promoted model (default_name if none recorded)"""
+    default_path = os.path.join(model_dir, default_name)
+    try:
+        with open(os.path.join(model_dir, ACTIVE_FILE)) as f:
+            path = os.path.join(model_dir, json.load(f)["model"])
+    except (OSError, ValueError, KeyError):
+        return default_path
+    return path if os.path.exists(path) else default_path
+
+
+def save_active_model(model_dir, bundle):
+    # Write-then-rename so a crash never leaves a truncated record
+    path = os.path.join(model_dir, ACTIVE_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "model": os.path.basename(bundle.path),
+            "version": bundle.version,
+            "sha256": bundle.sha256,
+            "promoted_at": time.time()
+        }, f)
+    os.replace(tmp_path, path)
+
+
+# =========================================================
+# 2. REGISTRY
+# =========================================================
+class ModelRegistry:
+    def __init__(
+        self,
+        model_dir,
+        default_name="acd_model.joblib",
+        poll_interval=30,
+        shadow_fraction=0.0,
+        promote_after=0,
+        max_rel_delta=0.05,
+        max_latency_ratio=2.0,
+        reference_size=256,
+        max_shadow_pending=2
+    ):
+        """
+        shadow_fraction     share of predict() calls also scored by the
+                            candidate (0 → swap as soon as warm-up passes)
+        promote_after       auto-decide after this many shadow batches
+                            (0 → wait for promote() / reject())
+        max_rel_delta       auto-promote only if mean |Δ| / mean active
+                            prediction stays at or below this ...
+        max_latency_ratio   ... and candidate / active predict time
+                            stays at or below this; otherwise the
+                            candidate is rejected
+        max_shadow_pending  shadow jobs allowed to queue (each holds a
+                            feature matrix); beyond this, calls are
+                            served without shadowing
+        """
+        self.model_dir = model_dir
+        self.poll_interval = poll_interval
+        self.shadow_fraction = shadow_fraction
+        self.promote_after = promote_after
+        self.max_rel_delta = max_rel_delta
+        self.max_latency_ratio = max_latency_ratio
+        self.reference_size = reference_size
+        self.max_shadow_pending = max_shadow_pending
+
+        self._lock = threading.Lock()
+        self._shadow_pool = ThreadPoolExecutor(max_workers=1)
+        self._shadow_pending = 0
+        self._seen = set()              # (path, mtime) already tried
+        self._reference = None          # recent live feature batch
+
+        self.active = load_bundle(active_model_path(model_dir, default_name))
+        self._seen.add((self.active.path, self.active.mtime))
+        self._warm_up(self.active)
+
+        self.candidate = None
+        self.shadow = self._empty_shadow()
+        self.events = []
+
+    # -----------------------------------------------------
+    # Serving
+    # -----------------------------------------------------
+    @property
+    def features(self):
+        return self.active.features
+
+    def predict(self, X):
+        """Predict with the active model; maybe shadow-score the candidate"""
+        active = self.active        # single read → consistent model
+        candidate = self.candidate
+
+        started = time.perf_counter()
+        preds = active.model.predict(X)
+        active_ms = (time.perf_counter() - started) * 1000
+
+        self._remember(X)
+
+        if candidate is not None and random.random() < self.shadow_fraction:
+            self._submit_shadow(candidate, X, preds, active_ms)
+
+        return preds
+
+    def _submit_shadow(self, candidate, X, active_preds, active_ms):
+        """Queue a shadow job unless the backlog is full (then skip it)"""
+        with self._lock:
+            if self._shadow_pending >= self.max_shadow_pending:
+                if self.candidate is candidate:
+                    self.shadow["skipped"] += 1
+                return
+            self._shadow_pending += 1
+
+        try:
+            self._shadow_pool.submit(
+                self._score_shadow, candidate, X, active_preds, active_ms
+            )
+        except Exception:
+            with self._lock:
+                self._shadow_pending -= 1
+            raise
+
+    # -----------------------------------------------------
+    # Loading / validation / warm-up
+    # -----------------------------------------------------
+    def _remember(self, X):
+        X = np.asarray(X)
+        if len(X):
+            self._reference = X[: self.reference_size].copy()
+
+    def _reference_batch(self, n_features):
+        if self._reference is not None and self._reference.shape[1] == n_features:
+            return self._reference
+        # No traffic yet → plausible reflectance / index range
+        rng = np.random.default_rng(0)
+        return rng.uniform(0.0, 1.0, size=(self.reference_size, n_features))
+
+    def _warm_up(self, bundle):
+        batch = self._reference_batch(len(bundle.features))
+        started = time.perf_counter()
+        preds = bundle.model.predict(batch)
+        bundle.warmup_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        if not np.all(np.isfinite(preds)):
+            raise ValueError("Warm-up produced non-finite predictions")
+
+    def _newest_model_file(self):
+        files = glob.glob(os.path.join(self.model_dir, "*.joblib"))
+        if not files:
+            return None
+        return max(files, key=os.path.getmtime)
+
+    def check_for_update(self):
+        """One watch cycle. Returns True if a new candidate was staged."""
+        path = self._newest_model_file()
+        if path is None:
+            return False
+
+        key = (path, os.path.getmtime(path))
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+
+        # A touched / re-copied file with the same content is not new
+        candidate = self.candidate
+        sha256 = file_sha256(path)
+        if sha256 == self.active.sha256 or (
+            candidate is not None and sha256 == candidate.sha256
+        ):
+            return False
+
+        try:
+            bundle = load_bundle(path, sha256)
+
+            if bundle.features != self.active.features:
+                raise ValueError(
+                    f"FEATURES mismatch: {bundle.features} "
+                    f"≠ {self.active.features}"
+                )
+
+            self._warm_up(bundle)
+
+        except Exception as e:
+            self._log("rejected", path, str(e))
+            print("⚠️ Model candidate rejected:", e)
+            return False
+
+        if self.shadow_fraction > 0:
+            with self._lock:
+                self.candidate = bundle
+                self.shadow = self._empty_shadow()
+            self._log("shadowing", bundle.version)
+            print("🔍 Shadow-scoring model candidate:", bundle.version)
+        else:
+            self._swap(bundle)
+
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.check_for_update()
+            except Exception as e:
+                print("⚠️ Model watcher error:", e)
+
+    def start(self):
+        threading.Thread(target=self._watch, daemon=True).start()
+        return self
+
+    # -----------------------------------------------------
+    # Promotion
+    # -----------------------------------------------------
+    def _swap(self, bundle, shadow=None):
+        with self._lock:
+            previous = self.active
+            self.active = bundle
+            self.candidate = None
+
+        try:
+            save_active_model(self.model_dir, bundle)
+        except OSError as e:
+            print("⚠️ Could not record promoted model:", e)
+
+        self._log("promoted", bundle.version, {
+            "replaced": previous.version,
+            "shadow": shadow
+        })
+        print("✅ Model promoted:", bundle.version)
+
+    def promote(self):
+        """Promote the shadow candidate. Returns False if there is none."""
+        candidate = self.candidate
+        if candidate is None:
+            return False
+        # Keep the shadow evidence the promotion was based on
+        self._swap(candidate, shadow=self.status()["shadow"])
+        return True
+
+    def reject(self, reason="manual", shadow=None):
+        """Drop the shadow candidate. Returns False if there is none."""
+        candidate = self.candidate
+        if candidate is None:
+            return False
+        with self._lock:
+            self.candidate = None
+        self._log(
+            "rejected", candidate.version,
+            {"reason": reason, "shadow": shadow} if shadow else reason
+        )
+        print("⚠️ Model candidate rejected:", candidate.version, reason)
+        return True
+
+    def _auto_decide(self, candidate, summary):
+        """Promote after promote_after batches if within limits, else reject"""
+        failures = []
+        rel_delta = summary["mean_rel_delta"]
+        if rel_delta is None or rel_delta > self.max_rel_delta:
+            failures.append(
+                f"mean_rel_delta {rel_delta} > {self.max_rel_delta}"
+            )
+        if summary["latency_ratio"] > self.max_latency_ratio:
+            failures.append(
+                f"latency_ratio {summary['latency_ratio']} > {self.max_latency_ratio}"
+            )
+
+        if self.candidate is not candidate:
+            return
+        if failures:
+            self.reject("; ".join(failures), shadow=summary)
+        else:
+            self.promote()
+
+    # -----------------------------------------------------
+    # Shadow metrics
+    # -----------------------------------------------------
+    @staticmethod
+    def _empty_shadow():
+        return {
+            "batches": 0,
+            "skipped": 0,
+            "pixels": 0,
+            "active_ms_total": 0.0,
+            "candidate_ms_total": 0.0,
+            "abs_delta_sum": 0.0,
+            "max_abs_delta": 0.0,
+            "active_sum": 0.0
+        }
+
+    def _score_shadow(self, candidate, X, active_preds, active_ms):
+        try:
+            started = time.perf_counter()
+            preds = candidate.model.predict(X)
+            candidate_ms = (time.perf_counter() - started) * 1000
+        except Exception as e:
+            self._log("shadow_error", candidate.version, str(e))
+            return
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+
+        delta = np.abs(np.asarray(preds) - np.asarray(active_preds))
+
+        with self._lock:
+            if self.candidate is not candidate:
+                return
+            s = self.shadow
+            s["batches"] += 1
+            s["pixels"] += len(delta)
+            s["active_ms_total"] += active_ms
+            s["candidate_ms_total"] += candidate_ms
+            s["abs_delta_sum"] += float(delta.sum())
+            s["max_abs_delta"] = max(s["max_abs_delta"], float(delta.max(initial=0.0)))
+            s["active_sum"] += float(np.sum(active_preds))
+            ready = self.promote_after and s["batches"] >= self.promote_after
+            summary = self._shadow_summary(s) if ready else None
+
+        if ready:
+            self._auto_decide(candidate, summary)
+
+    def _log(self, event, version, detail=None):
+        self.events.append({
+            "time": time.time(),
+            "event": event,
+            "version": version,
+            "detail": detail
+        })
+        del self.events[:-20]
+
+    @staticmethod
+    def _shadow_summary(s):
+        batches = max(s["batches"], 1)
+        pixels = max(s["pixels"], 1)
+        return {
+            "batches": s["batches"],
+            "skipped": s["skipped"],
+            "pixels": s["pixels"],
+            "active_ms_mean": round(s["active_ms_total"] / batches, 2),
+            "candidate_ms_mean": round(s["candidate_ms_total"] / batches, 2),
+            "latency_ratio": round(
+                s["candidate_ms_total"] / max(s["active_ms_total"], 1e-9), 3
+            ),
+            "mean_abs_delta_kg": s["abs_delta_sum"] / pixels,
+            "max_abs_delta_kg": s["max_abs_delta"],
+            "mean_rel_delta": (
+                s["abs_delta_sum"] / s["active_sum"] if s["active_sum"] else None
+            )
+        }
+
+    def status(self):
+        with self._lock:
+            s = dict(self.shadow)
+            candidate = self.candidate
+            pending = self._shadow_pending
+
+        shadow = None
+        if candidate is not None:
+            shadow = {
+                "candidate": candidate.describe(),
+                "pending": pending,
+                **self._shadow_summary(s)
+            }
+
+        return {
+            "active": self.active.describe(),
+            "shadow_fraction": self.shadow_fraction,
+            "shadow": shadow,
+            "events": list(self.events)
+        }
@@ -0,0 +1,220 @@
+# replay.py
+"""
+Replays captured CarboVista traffic against a target server
+
+Input is the JSONL written by request_capture.py
+(CARBOVISTA_CAPTURE_PATH). Requests keep their original spacing,
+compressed by --speedup, and run on --concurrency worker threads.
+
+Usage (from backend/):
+    python replay.py capture.jsonl --target http://127.0.0.1:5000 \
+        --concurrency 8 --speedup 4
+
+To take Earth Engine compute out of the measurement, start the target
+with CARBOVISTA_EE_CASSETTE=ee.jsonl CARBOVISTA_EE_MODE=replay
+(record the cassette once with CARBOVISTA_EE_MODE=record). The target
+still initialises EE at startup, so it needs EE credentials and
+network access, but no getInfo() call reaches EE.
+"""
+
+import argparse
+import json
+import math
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ------------------------------------------------------------
+# Loading captured requests
+# ------------------------------------------------------------
+def load_capture(path, paths=None, limit=None):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if paths and record["path"] not in paths:
+                continue
+            if record.get("payload") is None:
+                continue
+            records.append(record)
+
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def payload_for(record):
+    """PDF captures store image sizes only → send without images"""
+    payload = dict(record["payload"])
+    if record["path"] == "/download-pdf":
+        payload.pop("image_bytes", None)
+        payload["images"] = {}
+    return payload
+
+
+# ------------------------------------------------------------
+# One request
+# ------------------------------------------------------------
+def send(target, record, timeout, scheduled=None):
+    """
+    scheduled = perf_counter() time the request was due. Latency is
+    measured from then, so time spent waiting for a free worker
+    (client-side queueing) counts as latency.
+    """
+    url = target.rstrip("/") + record["path"]
+    if record.get("query"):
+        url += "?" + record["query"]
+
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload_for(record)).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method=record.get("method", "POST")
+    )
+
+    started = time.perf_counter() if scheduled is None else scheduled
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            n_bytes = len(resp.read())     # full body, incl. streams
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        n_bytes = len(e.read())
+        status = e.code
+    except Exception as e:
+        return {
+            "path": record["path"],
+            "status": None,
+            "error": str(e),
+            "latency_ms": (time.perf_counter() - started) * 1000,
+            "bytes": 0
+        }
+
+    return {
+        "path": record["path"],
+        "status": status,
+        "error": None if status < 400 else f"HTTP {status}",
+        "latency_ms": (time.perf_counter() - started) * 1000,
+        "bytes": n_bytes
+    }
+
+
+# ------------------------------------------------------------
+# Report
+# ------------------------------------------------------------
+def percentile(values, q):
+    """Nearest-rank percentile (values need not be sorted)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarise(results, elapsed_s):
+    def block(rows):
+        latencies = [r["latency_ms"] for r in rows]
+        errors = [r for r in rows if r["error"]]
+        return {
+            "requests": len(rows),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(rows), 4) if rows else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies) if latencies else None,
+            "mean_bytes": (
+                sum(r["bytes"] for r in rows) / len(rows) if rows else 0
+            )
+        }
+
+    by_path = {}
+    for r in results:
+        by_path.setdefault(r["path"], []).append(r)
+
+    return {
+        "elapsed_s": round(elapsed_s, 2),
+        "throughput_rps": round(len(results) / elapsed_s, 2) if elapsed_s else None,
+        "overall": block(results),
+        "by_path": {path: block(rows) for path, rows in sorted(by_path.items())}
+    }
+
+
+def print_report(report):
+    print(f"\n⏱  {report['elapsed_s']} s, {report['throughput_rps']} req/s")
+    header = f"{'path':<24}{'n':>6}{'err%':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"
+    print(header)
+    print("-" * len(header))
+
+    rows = list(report["by_path"].items()) + [("ALL", report["overall"])]
+    for path, b in rows:
+        fmt = lambda v: f"{v:.0f}" if v is not None else "-"
+        print(
+            f"{path:<24}{b['requests']:>6}{b['error_rate'] * 100:>7.1f}%"
+            f"{fmt(b['p50_ms']):>10}{fmt(b['p90_ms']):>10}"
+            f"{fmt(b['p99_ms']):>10}{fmt(b['max_ms']):>10}"
+        )
+
+
+# ------------------------------------------------------------
+# Main
+# ------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("capture", help="JSONL written by request_capture.py")
+    parser.add_argument("--target", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--speedup", type=float, default=1.0,
+        help="Compress original inter-arrival times (0 = no pacing)"
+    )
+    parser.add_argument("--paths", nargs="*", help="Only replay these routes")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture, args.paths, args.limit)
+    if not records:
+        print("⚠️ No replayable requests in", args.capture)
+        return
+
+    print(f"▶️  Replaying {len(records)} requests → {args.target}")
+
+    results = []
+    lock = threading.Lock()
+
+    def run(record, scheduled):
+        result = send(args.target, record, args.timeout, scheduled)
+        with lock:
+            results.append(result)
+
+    t0 = records[0]["ts"]
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for record in records:
+            if args.speedup > 0:
+                due = (record["ts"] - t0) / args.speedup
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                scheduled = started + due
+            else:
+                scheduled = time.perf_counter()
+            pool.submit(run, record, scheduled)
+
+    report = summarise(results, time.perf_counter() - started)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
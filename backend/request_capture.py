@@ -0,0 +1,100 @@
+# request_capture.py
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+
+"""
+Opt-in request capture for CarboVista (load-test replay input)
+Set CARBOVISTA_CAPTURE_PATH=/path/capture.jsonl to record sanitized
+payloads of the analysis routes with timing, one JSON line each.
+Replay them with replay.py.
+"""
+
+# Only the keys each route actually reads are kept
+CAPTURED_ROUTES = {
+    "/run-analysis": ["aoi", "start_date", "end_date", "sampling", "target_precision"],
+    "/run-analysis-stream": ["aoi", "start_date", "end_date"],
+    "/run-analysis-stats": ["aoi", "start_date", "end_date"],
+    "/grid-stats": ["aoi", "start_date", "end_date"],
+    "/download-csv": ["aoi", "start_date", "end_date"],
+    "/download-pdf": ["stats", "images"],
+    "/predict": None    # numeric feature values only (see sanitize_payload)
+}
+
+_write_lock = threading.Lock()
+
+
+def sanitize_payload(path, payload):
+    """Drops unknown keys, free text and embedded images"""
+    if not isinstance(payload, dict):
+        return None
+
+    if path == "/predict":
+        return {
+            k: v for k, v in payload.items()
+            if isinstance(v, (int, float)) and not isinstance(v, bool)
+        }
+
+    clean = {k: payload[k] for k in CAPTURED_ROUTES[path] if k in payload}
+
+    if path == "/download-pdf":
+        stats = dict(clean.get("stats") or {})
+        if "aoi_address" in stats:
+            stats["aoi_address"] = "redacted"
+        clean["stats"] = stats
+
+        # Map screenshots are large base64 blobs — keep only their size
+        images = clean.pop("images", None) or {}
+        clean["image_bytes"] = {
+            name: len(data) for name, data in images.items()
+            if isinstance(data, str)
+        }
+
+    return clean
+
+
+def install_capture(app, path=None):
+    """Registers before/after hooks when a capture path is configured"""
+    path = path or os.environ.get("CARBOVISTA_CAPTURE_PATH")
+    if not path:
+        return False
+
+    @app.before_request
+    def _capture_start():
+        if request.path in CAPTURED_ROUTES:
+            g.capture_started = time.perf_counter()
+            g.capture_ts = time.time()
+
+    @app.after_request
+    def _capture_end(response):
+        started = g.pop("capture_started", None)
+        if started is None:
+            return response
+
+        record = {
+            "ts": g.pop("capture_ts"),
+            "method": request.method,
+            "path": request.path,
+            "query": request.query_string.decode("utf-8") or None,
+            "payload": sanitize_payload(
+                request.path, request.get_json(silent=True)
+            ),
+            "status": response.status_code,
+            # Streaming routes: time to response headers only
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "streamed": response.is_streamed
+        }
+
+        try:
+            with _write_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print("⚠️ Request capture failed:", e)
+
+        return response
+
+    print("🎥 Capturing requests to", path)
+    return True
@@ -0,0 +1,224 @@
+# sampling_utils.py
+import numpy as np
+import pandas as pd
+
+"""
+Adaptive stratified sampling for AOI carbon totals
+Samples NDVI strata in rounds and stops once the 95% CI on the
+AOI total reaches the requested relative precision
+"""
+
+Z_95 = 1.96
+
+
+class NoVegetationError(ValueError):
+    """The AOI has no sampleable vegetation pixels"""
+
+
+# =========================================================
+# 1. STRATIFIED ESTIMATOR
+# =========================================================
+def stratified_estimate(df, stratum_counts, z=Z_95):
+    """
+    Stratified mean of df["carbon_kg"] and its relative CI half-width.
+
+    stratum_counts = {stratum: N_h} vegetation pixels per stratum.
+    Strata with fewer than 2 samples borrow the pooled variance.
+
+    Returns dict(mean, std, std_error, rel_precision, per_stratum);
+    std is the stratum-weighted pixel std of the AOI (not of the
+    Neyman-allocated sample, which over-represents variable strata).
+    """
+    total_n = sum(stratum_counts.values())
+    pooled_var = df["carbon_kg"].var() if len(df) > 1 else 0.0
+    if not np.isfinite(pooled_var):
+        pooled_var = 0.0
+
+    grouped = df.groupby("stratum")["carbon_kg"]
+    means = grouped.mean()
+    variances = grouped.var()
+    sizes = grouped.size()
+
+    mean = 0.0
+    variance = 0.0
+    per_stratum = {}
+
+    for h, N_h in stratum_counts.items():
+        if N_h == 0:
+            continue
+
+        W_h = N_h / total_n
+        n_h = int(sizes.get(h, 0))
+
+        if n_h == 0:
+            # Unsampled stratum → fall back to overall sample mean
+            mean_h = float(df["carbon_kg"].mean())
+            var_h = pooled_var
+        else:
+            mean_h = float(means[h])
+            var_h = float(variances[h]) if n_h > 1 else pooled_var
+
+        # Finite population correction (pixels are drawn without replacement)
+        fpc = max(0.0, 1.0 - n_h / N_h)
+
+        mean += W_h * mean_h
+        variance += W_h ** 2 * var_h * fpc / max(n_h, 1)
+
+        per_stratum[h] = {
+            "n_sampled": n_h,
+            "n_pixels": int(N_h),
+            "mean_acd": mean_h,
+            "std_acd": float(np.sqrt(var_h))
+        }
+
+    # Within- plus between-stratum variance, weighted by N_h
+    pixel_var = sum(
+        (p["n_pixels"] / total_n)
+        * (p["std_acd"] ** 2 + (p["mean_acd"] - mean) ** 2)
+        for p in per_stratum.values()
+    )
+
+    std_error = float(np.sqrt(variance))
+    rel_precision = z * std_error / mean if mean > 0 else float("inf")
+
+    return {
+        "mean": float(mean),
+        "std": float(np.sqrt(pixel_var)),
+        "std_error": std_error,
+        "rel_precision": float(rel_precision),
+        "per_stratum": per_stratum
+    }
+
+
+# =========================================================
+# 2. NEYMAN ALLOCATION FOR THE NEXT ROUND
+# =========================================================
+def next_allocation(estimate, stratum_counts, target_precision, budget, z=Z_95):
+    """
+    Extra pixels to draw per stratum so the target precision is met,
+    using Neyman allocation (n_h ∝ N_h · S_h). Capped by budget and
+    by at most doubling the current sample per round.
+    """
+    per_stratum = estimate["per_stratum"]
+    total_n = sum(stratum_counts.values())
+
+    weights = {
+        h: (stratum_counts[h] / total_n) * s["std_acd"]
+        for h, s in per_stratum.items()
+    }
+    sum_ws = sum(weights.values())
+    if sum_ws == 0 or budget <= 0:
+        return {}
+
+    # Required n for half-width = target · mean
+    d = target_precision * estimate["mean"] / z
+    fpc_term = sum(
+        (stratum_counts[h] / total_n) * s["std_acd"] ** 2
+        for h, s in per_stratum.items()
+    ) / total_n
+    n_required = sum_ws ** 2 / (d ** 2 + fpc_term) if d > 0 else budget
+
+    n_current = sum(s["n_sampled"] for s in per_stratum.values())
+    n_extra = int(np.ceil(n_required - n_current))
+    n_extra = max(0, min(n_extra, budget, max(n_current, 1)))
+
+    allocation = {}
+    for h, w in weights.items():
+        target_h = int(np.ceil((n_current + n_extra) * w / sum_ws))
+        extra_h = target_h - per_stratum[h]["n_sampled"]
+        remaining_h = stratum_counts[h] - per_stratum[h]["n_sampled"]
+        extra_h = min(extra_h, remaining_h)
+        if extra_h > 0:
+            allocation[h] = extra_h
+
+    # Per-stratum rounding up must not overshoot the budget
+    excess = sum(allocation.values()) - budget
+    for h in sorted(allocation, key=allocation.get, reverse=True):
+        if excess <= 0:
+            break
+        cut = min(excess, allocation[h])
+        allocation[h] -= cut
+        excess -= cut
+
+    return {h: n for h, n in allocation.items() if n > 0}
+
+
+# =========================================================
+# 3. ROUND LOOP
+# =========================================================
+def adaptive_stratified_sample(
+    draw,
+    stratum_counts,
+    target_precision=0.05,
+    initial_per_stratum=50,
+    max_rounds=6,
+    max_pixels=5000,
+    z=Z_95
+):
+    """
+    draw(allocation, round_index) → DataFrame with at least
+    lon, lat, stratum and carbon_kg columns (EE sample + inference).
+
+    Returns (df, report). df holds every distinct sampled pixel;
+    report carries the stratified mean and achieved precision.
+    """
+    stratum_counts = {h: n for h, n in stratum_counts.items() if n > 0}
+    if not stratum_counts:
+        raise NoVegetationError("No valid vegetation pixels found")
+
+    allocation = {
+        h: min(initial_per_stratum, n) for h, n in stratum_counts.items()
+    }
+
+    df = pd.DataFrame()
+    estimate = None
+    rounds = 0
+
+    while allocation and rounds < max_rounds:
+        batch = draw(allocation, rounds)
+        rounds += 1
+
+        if batch is not None and not batch.empty:
+            # Different seeds can hit the same pixel twice
+            df = (
+                pd.concat([df, batch], ignore_index=True)
+                .drop_duplicates(subset=["lon", "lat"])
+                .reset_index(drop=True)
+            )
+
+        if df.empty:
+            break
+
+        estimate = stratified_estimate(df, stratum_counts, z)
+        if estimate["rel_precision"] <= target_precision:
+            break
+
+        allocation = next_allocation(
+            estimate,
+            stratum_counts,
+            target_precision,
+            budget=max_pixels - len(df),
+            z=z
+        )
+
+    if estimate is None:
+        raise NoVegetationError("No valid vegetation pixels found")
+
+    report = {
+        "mode": "adaptive",
+        "rounds": rounds,
+        "target_precision": target_precision,
+        "achieved_precision": round(estimate["rel_precision"], 4),
+        "converged": estimate["rel_precision"] <= target_precision,
+        "stratified_mean_acd": estimate["mean"],
+        "stratified_std_acd": estimate["std"],
+        # Exact vegetation pixel count N = Σ N_h (scales mean → total)
+        "n_vegetated_pixels": int(sum(stratum_counts.values())),
+        # Observed range of the sample; not design-weighted
+        "sample_only_fields": ["min_acd", "max_acd"],
+        "strata": {
+            str(h): s for h, s in estimate["per_stratum"].items()
+        }
+    }
+
+    return df, report
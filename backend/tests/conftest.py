@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# Backend modules are imported flat (run from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
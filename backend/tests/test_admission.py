@@ -0,0 +1,78 @@
+# test_admission.py
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, BYTES_PER_PIXEL
+
+PER_PIXEL = BYTES_PER_PIXEL["geojson"]
+
+
+def controller(budget_pixels, max_wait_s=0.0):
+    return AdmissionController(
+        budget_pixels * PER_PIXEL, max_wait_s=max_wait_s, min_pixels=500
+    )
+
+
+def test_admits_when_within_budget():
+    ac = controller(10_000)
+
+    with ac.admit(5000, "geojson") as granted:
+        assert granted == 5000
+        assert ac.metrics()["in_flight_bytes"] == 5000 * PER_PIXEL
+
+    m = ac.metrics()
+    assert m["in_flight_bytes"] == 0
+    assert (m["admitted"], m["downsampled"], m["rejected"]) == (1, 0, 0)
+
+
+def test_downsamples_to_what_fits():
+    ac = controller(10_000)
+
+    with ac.admit(8000, "geojson"):
+        # 2000 pixels left; the request still clears min_pixels
+        with ac.admit(5000, "geojson") as granted:
+            assert granted == 2000
+
+    m = ac.metrics()
+    assert m["downsampled"] == 1
+    assert m["in_flight_bytes"] == 0
+
+
+def test_rejects_when_too_little_fits():
+    ac = controller(10_000)
+
+    with ac.admit(9800, "geojson"):
+        with pytest.raises(AdmissionRejected) as e:
+            with ac.admit(5000, "geojson"):
+                pass
+        assert e.value.status == 503
+
+    # Budget smaller than min_pixels → permanent, rejected without waiting
+    with pytest.raises(AdmissionRejected) as e:
+        with controller(100).admit(5000, "geojson"):
+            pass
+    assert e.value.status == 413
+
+    assert ac.metrics()["rejected"] == 1
+
+
+def test_waits_for_release_before_downsampling():
+    ac = controller(10_000, max_wait_s=5.0)
+    held = threading.Event()
+
+    def hold():
+        with ac.admit(10_000, "geojson"):
+            held.set()
+            time.sleep(0.2)
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    held.wait()
+
+    with ac.admit(5000, "geojson") as granted:
+        assert granted == 5000
+
+    worker.join()
+    assert ac.metrics()["queued"] == 1
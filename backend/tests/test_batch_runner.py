@@ -0,0 +1,154 @@
+# test_batch_runner.py
+import json
+from urllib.error import URLError
+
+import pytest
+
+pytest.importorskip("ee")
+
+import batch_runner
+from ee_scheduler import EEQuotaError
+
+SQUARE = [[[0.0, 0.0], [0.01, 0.0], [0.01, 0.01], [0.0, 0.01], [0.0, 0.0]]]
+
+
+def feature(properties, geometry=None):
+    return {
+        "type": "Feature",
+        "properties": properties,
+        "geometry": geometry or {"type": "Polygon", "coordinates": SQUARE}
+    }
+
+
+def write_geojson(path, features):
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    return str(path)
+
+
+def test_read_geojson_fills_dates_and_ids(tmp_path):
+    path = write_geojson(tmp_path / "aois.geojson", [
+        feature({"id": "parcel 7/a", "start_date": "2024-06-01"}),
+        feature({})
+    ])
+
+    jobs = batch_runner.read_aois(path, "2024-01-01", "2024-12-31")
+
+    assert [j["id"] for j in jobs] == ["parcel_7_a", "2"]
+    assert [(j["start_date"], j["end_date"]) for j in jobs] == [
+        ("2024-06-01", "2024-12-31"),
+        ("2024-01-01", "2024-12-31")
+    ]
+    assert jobs[0]["aoi"] == SQUARE
+
+
+def test_read_csv(tmp_path):
+    path = tmp_path / "aois.csv"
+    geometry = json.dumps({"type": "Polygon", "coordinates": SQUARE}).replace('"', '""')
+    path.write_text(
+        "id,start_date,end_date,geometry\n"
+        f'farm-1,2024-01-01,2024-03-31,"{geometry}"\n'
+    )
+
+    [job] = batch_runner.read_aois(str(path))
+
+    assert job == {
+        "id": "farm-1",
+        "aoi": SQUARE,
+        "start_date": "2024-01-01",
+        "end_date": "2024-03-31"
+    }
+
+
+@pytest.mark.parametrize("features, message", [
+    ([feature({"id": "a"}), feature({"id": "a"})], "Duplicate AOI id"),
+    ([feature({"id": "a"}, {"type": "Point", "coordinates": [0, 0]})], "only Polygon"),
+])
+def test_read_rejects_bad_input(tmp_path, features, message):
+    path = write_geojson(tmp_path / "aois.geojson", features)
+    with pytest.raises(ValueError, match=message):
+        batch_runner.read_aois(path, "2024-01-01", "2024-12-31")
+
+
+def test_read_requires_dates(tmp_path):
+    path = write_geojson(tmp_path / "aois.geojson", [feature({"id": "a"})])
+    with pytest.raises(ValueError, match="missing date range"):
+        batch_runner.read_aois(path)
+
+
+@pytest.mark.parametrize("exc, transient", [
+    (EEQuotaError("EE quota exhausted after retries"), True),
+    (URLError("connection refused"), True),
+    (TimeoutError(), True),
+    (RuntimeError("Computation timed out."), True),
+    (RuntimeError("Too many concurrent aggregations"), True),
+    (ValueError("No valid vegetation pixels found"), False),
+    (ValueError("AOI too large (80.00 km²)"), False),
+])
+def test_failures_are_classified(exc, transient):
+    entry = batch_runner.failure_entry("a", exc)
+    assert entry["error_type"] == type(exc).__name__
+    assert entry["transient"] is transient
+
+
+def test_resume_skips_done_and_retries_transient(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    entries = [
+        {"id": "ok", "status": "ok", "stats": {}},
+        batch_runner.failure_entry("quota", EEQuotaError("quota")),
+        batch_runner.failure_entry("empty", ValueError("No valid vegetation pixels found")),
+        # Written before failures were classified
+        {"id": "old", "status": "failed", "error": "boom"},
+        {"id": "rerun", "status": "failed", "error": "boom"},
+        {"id": "rerun", "status": "ok", "stats": {}}
+    ]
+    for entry in entries:
+        batch_runner.append_checkpoint(path, entry)
+
+    checkpoint = batch_runner.read_checkpoint(path)
+
+    # Last entry per id wins
+    assert checkpoint["rerun"]["status"] == "ok"
+
+    ids = ["ok", "quota", "empty", "old", "rerun", "new"]
+    pending = [i for i in ids if batch_runner.is_pending(checkpoint.get(i))]
+    assert pending == ["quota", "new"]
+
+    pending = [i for i in ids if batch_runner.is_pending(checkpoint.get(i), True)]
+    assert pending == ["quota", "empty", "old", "new"]
+
+
+def test_stats_frame_flattens_class_shares():
+    checkpoint = {
+        "a": {"id": "a", "status": "ok", "stats": {
+            "total_carbon_kg": 1200.0,
+            "aoi_address": "Somewhere",
+            "class_shares": {"Low": 0.5, "Medium": 0.3, "High": 0.2}
+        }},
+        "b": batch_runner.failure_entry("b", ValueError("bad"))
+    }
+
+    table = batch_runner.stats_frame(checkpoint)
+
+    assert table.to_dict("records") == [{
+        "id": "a",
+        "total_carbon_kg": 1200.0,
+        "share_low": 0.5,
+        "share_medium": 0.3,
+        "share_high": 0.2
+    }]
+    # The checkpoint itself is left untouched
+    assert "class_shares" in checkpoint["a"]["stats"]
+
+
+def test_write_stats_table(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pandas as pd
+
+    checkpoint = {"a": {"id": "a", "status": "ok", "stats": {"total_carbon_kg": 5.0}}}
+
+    assert batch_runner.write_stats_table(checkpoint, str(tmp_path)) == 1
+    table = pd.read_parquet(tmp_path / "stats.parquet")
+    assert table.to_dict("records") == [{"id": "a", "total_carbon_kg": 5.0}]
+
+    # Nothing completed → no file
+    assert batch_runner.write_stats_table({}, str(tmp_path / "empty")) == 0
@@ -0,0 +1,149 @@
+# test_carbon_grid.py
+import os
+
+import numpy as np
+import pytest
+
+import carbon_grid
+
+TILES = [(tx, ty) for ty in (20, 21) for tx in (10, 11, 12)]
+VERSION = "3f2a9c41d0e7"
+
+
+@pytest.fixture
+def grid(tmp_path, monkeypatch):
+    """3 × 2 random tiles (10% no-data) in a temporary grid directory"""
+    monkeypatch.setattr(carbon_grid, "GRID_DIR", str(tmp_path))
+    monkeypatch.setattr(carbon_grid, "_TILE_CACHE", {})
+
+    rng = np.random.default_rng(0)
+    T = carbon_grid.TILE_CELLS
+    rasters = {}
+    for tx, ty in TILES:
+        carbon = rng.uniform(0, 100, (T, T)).astype(np.float32)
+        carbon[rng.random((T, T)) < 0.1] = np.nan
+        carbon_grid.save_tile("2024-01-01", "2024-12-31", tx, ty, carbon, VERSION)
+        rasters[(tx, ty)] = carbon
+    return rasters
+
+
+def point_in_ring(lon, lat, ring):
+    """Even-odd rule, independent of carbon_grid.row_spans"""
+    inside = False
+    n = len(ring)
+    for i in range(n):
+        x1, y1 = ring[i]
+        x2, y2 = ring[(i + 1) % n]
+        if (y1 > lat) != (y2 > lat):
+            if lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+    return inside
+
+
+def brute_force(rasters, ring):
+    """Every pixel whose centre is inside the ring, tile by tile"""
+    T = carbon_grid.TILE_CELLS
+    values = []
+    for (tx, ty), carbon in rasters.items():
+        lon_min, _, _, lat_max = carbon_grid.tile_bounds(tx, ty)
+        for r in range(T):
+            lat = lat_max - (r + 0.5) * carbon_grid.CELL_DEG
+            for c in range(T):
+                lon = lon_min + (c + 0.5) * carbon_grid.CELL_DEG
+                if not np.isnan(carbon[r, c]) and point_in_ring(lon, lat, ring):
+                    values.append(float(carbon[r, c]))
+    return np.array(values)
+
+
+def aoi_across_tiles():
+    """Concave polygon touching all four tiles"""
+    lon0, _, lon1, lat1 = carbon_grid.tile_bounds(10, 20)
+    _, lat0, _, _ = carbon_grid.tile_bounds(10, 21)
+    lon2 = carbon_grid.tile_bounds(11, 20)[2]
+    w, h = lon2 - lon0, lat1 - lat0
+
+    ring = [
+        [lon0 + 0.13 * w, lat0 + 0.21 * h],
+        [lon0 + 0.87 * w, lat0 + 0.07 * h],
+        [lon0 + 0.61 * w, lat0 + 0.52 * h],    # notch → concave
+        [lon0 + 0.93 * w, lat0 + 0.89 * h],
+        [lon0 + 0.29 * w, lat0 + 0.95 * h],
+        [lon0 + 0.13 * w, lat0 + 0.21 * h]
+    ]
+    return [ring]
+
+
+def test_query_matches_brute_force(grid):
+    aoi = aoi_across_tiles()
+    expected = brute_force(grid, aoi[0][:-1])
+
+    moments = carbon_grid.query_aoi(aoi, "2024-01-01", "2024-12-31", VERSION)
+
+    assert moments["n_pixels"] == len(expected)
+    assert moments["mean"] == pytest.approx(expected.mean(), rel=1e-9)
+    assert moments["std"] == pytest.approx(expected.std(ddof=1), rel=1e-6)
+    assert moments["min"] == pytest.approx(expected.min())
+    assert moments["max"] == pytest.approx(expected.max())
+    assert moments["class_counts"] == {
+        "Low": int((expected < 30).sum()),
+        "Medium": int(((expected >= 30) & (expected < 60)).sum()),
+        "High": int((expected >= 60).sum())
+    }
+
+
+def test_whole_tile_rows_use_stored_extrema(grid):
+    # Spans the middle column of tiles completely on every row
+    lon0 = carbon_grid.tile_bounds(10, 20)[0]
+    lon1 = carbon_grid.tile_bounds(12, 20)[2]
+    lat0 = carbon_grid.tile_bounds(10, 21)[1]
+    lat1 = carbon_grid.tile_bounds(10, 20)[3]
+    w, h = lon1 - lon0, lat1 - lat0
+    ring = [
+        [lon0 + 0.05 * w, lat0 + 0.10 * h],
+        [lon0 + 0.97 * w, lat0 + 0.30 * h],
+        [lon0 + 0.90 * w, lat0 + 0.93 * h],
+        [lon0 + 0.02 * w, lat0 + 0.85 * h],
+        [lon0 + 0.05 * w, lat0 + 0.10 * h]
+    ]
+    expected = brute_force(grid, ring[:-1])
+
+    moments = carbon_grid.query_aoi([ring], "2024-01-01", "2024-12-31")
+
+    assert moments["n_pixels"] == len(expected)
+    assert moments["total"] == pytest.approx(expected.sum(), rel=1e-9)
+    assert moments["min"] == pytest.approx(expected.min())
+    assert moments["max"] == pytest.approx(expected.max())
+
+
+def test_rebuilt_tile_replaces_cached_copy(grid):
+    aoi = aoi_across_tiles()
+    assert carbon_grid.query_aoi(aoi, "2024-01-01", "2024-12-31", VERSION)
+
+    # Rebuild every tile with another model; cached copies are stale
+    for (tx, ty), carbon in grid.items():
+        carbon_grid.save_tile(
+            "2024-01-01", "2024-12-31", tx, ty, carbon, "8b61e05f7c2d"
+        )
+        path = carbon_grid.tile_path("2024-01-01", "2024-12-31", tx, ty)
+        os.utime(path, (1, 1))      # mtime differs even on coarse clocks
+
+    assert carbon_grid.query_aoi(
+        aoi, "2024-01-01", "2024-12-31", "8b61e05f7c2d"
+    ) is not None
+
+
+def test_missing_tile_falls_back(grid):
+    lon_min, lat_min, lon_max, lat_max = carbon_grid.tile_bounds(13, 20)
+    aoi = [[
+        [lon_min, lat_min], [lon_max, lat_min],
+        [lon_max, lat_max], [lon_min, lat_max], [lon_min, lat_min]
+    ]]
+    assert carbon_grid.query_aoi(aoi, "2024-01-01", "2024-12-31") is None
+
+
+def test_other_period_or_model_falls_back(grid):
+    aoi = aoi_across_tiles()
+    assert carbon_grid.query_aoi(aoi, "2023-01-01", "2023-12-31") is None
+    assert carbon_grid.query_aoi(
+        aoi, "2024-01-01", "2024-12-31", model_version="8b61e05f7c2d"
+    ) is None
@@ -0,0 +1,87 @@
+# test_ee_model_utils.py
+import re
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ee")
+from sklearn.ensemble import RandomForestRegressor
+
+from ee_model_utils import forest_to_strings, tree_to_string
+
+FEATURES = ["B4", "B8", "NDVI", "BSI"]
+
+LINE = re.compile(
+    r"^(?P<indent> *)(?P<id>\d+)\) (?P<split>root|(?P<name>\w+)(?P<op><=|>)(?P<thr>\S+)) "
+    r"\d+ \d+ (?P<value>\S+)(?P<leaf> \*)?$"
+)
+
+
+def parse_tree(text):
+    """{node id: (feature, op, threshold, value, is_leaf)} from an rpart string"""
+    nodes = {}
+    for line in text.split("\n"):
+        m = LINE.match(line)
+        assert m, f"unparseable line: {line!r}"
+        nodes[int(m["id"])] = (
+            m["name"],
+            m["op"],
+            float(m["thr"]) if m["thr"] else None,
+            float(m["value"]),
+            bool(m["leaf"])
+        )
+    return nodes
+
+
+def predict_tree(nodes, row):
+    """Walks the rpart tree the way EE does: children of n are 2n / 2n+1"""
+    node = 1
+    while not nodes[node][4]:
+        for child in (2 * node, 2 * node + 1):
+            name, op, threshold, _, _ = nodes[child]
+            x = row[FEATURES.index(name)]
+            if (x <= threshold) if op == "<=" else (x > threshold):
+                node = child
+                break
+        else:
+            raise AssertionError(f"no child of node {node} matches")
+    return nodes[node][3]
+
+
+@pytest.fixture(scope="module")
+def forest():
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 1, (400, len(FEATURES)))
+    y = 80 * X[:, 2] + 20 * X[:, 1] - 10 * X[:, 3] + rng.normal(0, 2, 400)
+    model = RandomForestRegressor(n_estimators=10, max_depth=8, random_state=0)
+    return model.fit(X, y), rng.uniform(0, 1, (200, len(FEATURES)))
+
+
+def test_strings_reproduce_sklearn(forest):
+    model, X = forest
+    trees = [parse_tree(s) for s in forest_to_strings(model, FEATURES)]
+
+    ee_like = np.array([
+        np.mean([predict_tree(t, row) for t in trees]) for row in X
+    ])
+
+    np.testing.assert_allclose(ee_like, model.predict(X), atol=1e-5)
+
+
+def test_format(forest):
+    model, _ = forest
+    text = tree_to_string(model.estimators_[0], FEATURES)
+    lines = text.split("\n")
+
+    assert lines[0].startswith("1) root ")
+    assert all(LINE.match(line) for line in lines)
+    # Fixed-point thresholds only: EE cannot parse scientific notation
+    assert "e-" not in text and "e+" not in text
+
+
+def test_single_leaf_tree():
+    X = np.zeros((5, len(FEATURES)))
+    model = RandomForestRegressor(n_estimators=1, random_state=0).fit(X, np.full(5, 7.0))
+    text = tree_to_string(model.estimators_[0], FEATURES)
+    assert re.fullmatch(r"1\) root \d+ 9999 7\.000000 \*", text)
+    assert predict_tree(parse_tree(text), X[0]) == 7.0
@@ -0,0 +1,141 @@
+# test_ee_scheduler.py
+import threading
+import time
+
+import pytest
+
+import ee_scheduler
+from ee_scheduler import EEQuotaError, EEScheduler, TokenBucket
+
+
+def scheduler(**kwargs):
+    options = dict(rate_per_sec=1000, burst=1000, base_delay=0.001, max_delay=0.01)
+    options.update(kwargs)
+    return EEScheduler(**options)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_priority_order_then_fifo():
+    s = scheduler(max_concurrent=1)
+    release = threading.Event()
+    order = []
+
+    blocker = threading.Thread(target=s.submit, args=(release.wait,))
+    blocker.start()
+    wait_until(lambda: s.metrics()["in_flight"] == 1)
+
+    threads = []
+    for name, priority in [
+        ("batch", "batch"),
+        ("export", "export"),
+        ("interactive-1", "interactive"),
+        ("interactive-2", "interactive")
+    ]:
+        t = threading.Thread(
+            target=s.submit,
+            args=(lambda name=name: order.append(name), priority)
+        )
+        t.start()
+        threads.append(t)
+        queued = len(threads)
+        wait_until(lambda: s.metrics()["queued_total"] == queued)
+
+    release.set()
+    for t in [blocker] + threads:
+        t.join()
+
+    assert order == ["interactive-1", "interactive-2", "export", "batch"]
+
+
+def test_quota_errors_retry_until_limit():
+    s = scheduler(max_retries=3)
+    calls = []
+
+    def always_busy():
+        calls.append(1)
+        raise RuntimeError("Too many concurrent aggregations")
+
+    with pytest.raises(EEQuotaError):
+        s.submit(always_busy)
+
+    assert len(calls) == 4              # first try + 3 retries
+    m = s.metrics()
+    assert (m["retries"], m["quota_errors"], m["failed"]) == (3, 4, 1)
+    assert m["in_flight"] == 0
+
+
+def test_quota_error_then_success():
+    s = scheduler(max_retries=3)
+    results = iter([RuntimeError("Quota exceeded"), RuntimeError("HTTP 429"), "ok"])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert s.submit(flaky) == "ok"
+    assert s.metrics()["retries"] == 2
+
+
+def test_other_errors_are_not_retried():
+    s = scheduler(max_retries=3)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("Image.select: band not found")
+
+    with pytest.raises(ValueError):
+        s.submit(broken)
+    assert len(calls) == 1
+
+
+def test_backoff_is_capped_full_jitter(monkeypatch):
+    s = EEScheduler(base_delay=0.5, max_delay=4.0)
+
+    monkeypatch.setattr(ee_scheduler.random, "uniform", lambda lo, hi: hi)
+    assert [s._backoff(a) for a in range(6)] == [0.5, 1.0, 2.0, 4.0, 4.0, 4.0]
+
+    monkeypatch.setattr(ee_scheduler.random, "uniform", lambda lo, hi: lo)
+    assert s._backoff(3) == 0
+
+
+def test_full_queue_is_shed():
+    s = scheduler(max_concurrent=1, max_queue_depth=1, max_queue_wait_s=0.1)
+    release = threading.Event()
+
+    blocker = threading.Thread(target=s.submit, args=(release.wait,))
+    blocker.start()
+    wait_until(lambda: s.metrics()["in_flight"] == 1)
+
+    # Waits for max_queue_wait_s, then gives up
+    with pytest.raises(EEQuotaError):
+        s.submit(lambda: None)
+
+    waiter = threading.Thread(target=s.submit, args=(lambda: None,))
+    s.max_queue_wait_s = None
+    waiter.start()
+    wait_until(lambda: s.metrics()["queued_total"] == 1)
+
+    # Queue depth reached → rejected without waiting
+    with pytest.raises(EEQuotaError):
+        s.submit(lambda: None)
+
+    release.set()
+    blocker.join()
+    waiter.join()
+    assert s.metrics()["shed"] == 2
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(0, 10)
+    with pytest.raises(ValueError):
+        EEScheduler(rate_per_sec=-1)
@@ -0,0 +1,35 @@
+# test_gee_utils.py
+import pytest
+
+pytest.importorskip("ee")
+
+from gee_utils import _clip_ring_to_lat_band, _ring_area, lat_band_shares
+
+# Concave "C" shape: the notch leaves the middle latitudes thin
+C_RING = [
+    [0.0, 0.0], [3.0, 0.0], [3.0, 1.0], [1.0, 1.0],
+    [1.0, 3.0], [3.0, 3.0], [3.0, 4.0], [0.0, 4.0], [0.0, 0.0]
+]
+
+
+def test_concave_shares_sum_to_one():
+    bands = lat_band_shares([C_RING], n_chunks=4)
+
+    assert [i for i, *_ in bands] == [0, 1, 2, 3]
+    assert sum(share for *_, share in bands) == pytest.approx(1.0)
+    # Area 8: the outer bands are 3 wide, the notched ones 1 wide
+    assert [share for *_, share in bands] == pytest.approx([3 / 8, 1 / 8, 1 / 8, 3 / 8])
+    assert bands[-1][2] == 4.0
+
+
+def test_clipped_ring_stays_inside_the_band():
+    clipped = _clip_ring_to_lat_band(C_RING, 0.5, 2.5)
+
+    assert all(0.5 <= lat <= 2.5 for _, lat in clipped)
+    # 3 × 0.5 at the bottom + 1 × 1.5 across the notch
+    assert _ring_area(clipped) == pytest.approx(3.0)
+
+
+def test_clip_outside_the_ring_is_empty():
+    assert _clip_ring_to_lat_band(C_RING, 5.0, 6.0) == []
+    assert lat_band_shares([[[0, 0], [1, 0], [2, 0], [0, 0]]]) == []
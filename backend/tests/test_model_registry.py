@@ -0,0 +1,164 @@
+# test_model_registry.py
+import json
+import os
+import shutil
+import threading
+import time
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+import model_registry
+from model_registry import ModelRegistry, file_sha256
+
+FEATURES = ["B4", "B8", "NDVI", "BSI"]
+
+rng = np.random.default_rng(0)
+X = rng.uniform(0, 1, (200, len(FEATURES)))
+Y = 40 + 60 * X[:, 2] + 10 * X[:, 1]
+
+
+def save_model(model_dir, name, scale=1.0, features=FEATURES):
+    """RF stand-in predicting scale · Y; each new file is the newest"""
+    path = os.path.join(model_dir, name)
+    model = LinearRegression().fit(X[:, : len(features)], scale * Y)
+    joblib.dump({"model": model, "features": features}, path)
+    mtime = time.time() - 1000 + 10 * len(os.listdir(model_dir))
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def last_event(registry):
+    return registry.events[-1]["event"] if registry.events else None
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    save_model(str(tmp_path), "acd_model.joblib")
+    return str(tmp_path)
+
+
+def test_restart_keeps_promoted_model(model_dir):
+    registry = ModelRegistry(model_dir)
+    path = save_model(model_dir, "acd_model_v2.joblib", scale=1.01)
+
+    assert registry.check_for_update()
+    assert registry.active.path == path
+
+    with open(os.path.join(model_dir, model_registry.ACTIVE_FILE)) as f:
+        record = json.load(f)
+    assert record["model"] == "acd_model_v2.joblib"
+    assert record["sha256"] == file_sha256(path)
+    assert record["version"] == record["sha256"][:12]
+
+    # A restart serves the promoted model, not the default file
+    assert ModelRegistry(model_dir).active.sha256 == record["sha256"]
+
+
+def test_same_content_is_not_a_new_model(model_dir):
+    registry = ModelRegistry(model_dir)
+    original = registry.active.path
+
+    copy = os.path.join(model_dir, "acd_model_copy.joblib")
+    shutil.copy(original, copy)
+    assert not registry.check_for_update()
+
+    os.utime(original)          # touched → newest again, same content
+    assert not registry.check_for_update()
+    assert registry.active.path == original
+    assert registry.candidate is None
+
+
+def test_feature_mismatch_is_rejected(model_dir):
+    registry = ModelRegistry(model_dir)
+    save_model(model_dir, "acd_model_v2.joblib", features=FEATURES[:3])
+
+    assert not registry.check_for_update()
+    assert last_event(registry) == "rejected"
+    assert registry.active.path.endswith("acd_model.joblib")
+
+
+def test_auto_rejects_drifting_candidate(model_dir):
+    registry = ModelRegistry(
+        model_dir, shadow_fraction=1.0, promote_after=2, max_latency_ratio=1e6
+    )
+    save_model(model_dir, "acd_model_v2.joblib", scale=2.0)
+    assert registry.check_for_update()
+    active_version = registry.active.version
+
+    for _ in range(2):
+        registry.predict(X)
+    wait_until(lambda: last_event(registry) == "rejected")
+
+    event = registry.events[-1]
+    assert event["event"] == "rejected"
+    assert "mean_rel_delta" in event["detail"]["reason"]
+    assert event["detail"]["shadow"]["mean_rel_delta"] == pytest.approx(1.0)
+    assert registry.active.version == active_version
+
+
+def test_auto_promotes_within_limits(model_dir):
+    registry = ModelRegistry(
+        model_dir, shadow_fraction=1.0, promote_after=2, max_latency_ratio=1e6
+    )
+    save_model(model_dir, "acd_model_v2.joblib", scale=1.01)
+    assert registry.check_for_update()
+    candidate = registry.candidate
+
+    for _ in range(2):
+        registry.predict(X)
+    wait_until(lambda: last_event(registry) == "promoted")
+
+    assert registry.candidate is None
+    assert registry.active is candidate
+
+
+def test_shadow_backlog_is_capped(model_dir):
+    registry = ModelRegistry(model_dir, shadow_fraction=1.0, max_shadow_pending=1)
+    save_model(model_dir, "acd_model_v2.joblib", scale=1.01)
+    assert registry.check_for_update()
+
+    release = threading.Event()
+    started = threading.Event()
+    model = registry.candidate.model
+
+    class Slow:
+        def predict(self, X):
+            started.set()
+            release.wait()
+            return model.predict(X)
+
+    registry.candidate.model = Slow()
+
+    registry.predict(X)
+    started.wait()
+    for _ in range(3):
+        registry.predict(X)         # backlog full → served without shadow
+
+    shadow = registry.status()["shadow"]
+    assert (shadow["pending"], shadow["skipped"]) == (1, 3)
+
+    release.set()
+    wait_until(lambda: registry.status()["shadow"]["pending"] == 0)
+    assert registry.status()["shadow"]["batches"] == 1
+
+
+def test_manual_reject(model_dir):
+    registry = ModelRegistry(model_dir, shadow_fraction=0.5)
+    assert not registry.reject()
+
+    save_model(model_dir, "acd_model_v2.joblib", scale=1.01)
+    assert registry.check_for_update()
+    assert registry.reject("worse on field plots")
+
+    assert registry.candidate is None
+    assert registry.events[-1]["detail"] == "worse on field plots"
@@ -0,0 +1,68 @@
+# test_replay.py
+import pytest
+
+from replay import percentile, summarise
+
+
+def test_percentile_nearest_rank():
+    values = [15, 20, 35, 40, 50]       # textbook nearest-rank example
+    assert percentile(values, 5) == 15
+    assert percentile(values, 30) == 20
+    assert percentile(values, 40) == 20
+    assert percentile(values, 50) == 35
+    assert percentile(values, 100) == 50
+
+
+def test_percentile_unsorted_and_edge_cases():
+    assert percentile([9, 1, 5, 3, 7], 50) == 5
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile([42], 99) == 42
+    assert percentile([3, 1], 0) == 1
+    assert percentile([], 50) is None
+
+
+def row(path, latency_ms, error=None, size=100):
+    return {"path": path, "latency_ms": latency_ms, "error": error, "bytes": size}
+
+
+def test_summarise_overall_and_by_path():
+    results = (
+        [row("/run-analysis", ms) for ms in range(10, 110, 10)]
+        + [row("/grid-stats", 5, size=40), row("/grid-stats", 7, error="HTTP 503", size=60)]
+    )
+
+    report = summarise(results, elapsed_s=4.0)
+
+    assert report["elapsed_s"] == 4.0
+    assert report["throughput_rps"] == 3.0
+    assert list(report["by_path"]) == ["/grid-stats", "/run-analysis"]
+
+    overall = report["overall"]
+    assert (overall["requests"], overall["errors"]) == (12, 1)
+    assert overall["error_rate"] == pytest.approx(1 / 12, abs=1e-4)
+    assert overall["max_ms"] == 100
+
+    analysis = report["by_path"]["/run-analysis"]
+    assert (analysis["p50_ms"], analysis["p90_ms"], analysis["p99_ms"]) == (50, 90, 100)
+    assert analysis["error_rate"] == 0.0
+
+    grid = report["by_path"]["/grid-stats"]
+    assert (grid["errors"], grid["error_rate"], grid["mean_bytes"]) == (1, 0.5, 50)
+
+
+def test_summarise_empty_run():
+    report = summarise([], elapsed_s=0)
+
+    assert report["throughput_rps"] is None
+    assert report["by_path"] == {}
+    assert report["overall"] == {
+        "requests": 0,
+        "errors": 0,
+        "error_rate": 0.0,
+        "p50_ms": None,
+        "p90_ms": None,
+        "p95_ms": None,
+        "p99_ms": None,
+        "max_ms": None,
+        "mean_bytes": 0
+    }
@@ -0,0 +1,114 @@
+# test_sampling_utils.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from sampling_utils import (
+    NoVegetationError,
+    adaptive_stratified_sample,
+    stratified_estimate
+)
+
+# Synthetic AOI: NDVI strata with different sizes, means and spreads
+STRATA = {
+    0: (6000, 15.0, 4.0),
+    1: (3000, 35.0, 10.0),
+    2: (1500, 60.0, 25.0),
+    3: (500, 90.0, 40.0)
+}
+
+
+def make_population(seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        h: np.clip(rng.normal(mean, sd, n), 0, None)
+        for h, (n, mean, sd) in STRATA.items()
+    }
+
+
+def make_draw(population, seed=1):
+    """draw() that samples distinct pixels per stratum, like EE would"""
+    rng = np.random.default_rng(seed)
+    remaining = {h: rng.permutation(len(v)).tolist() for h, v in population.items()}
+
+    def draw(allocation, round_index):
+        rows = []
+        for h, n in allocation.items():
+            picked, remaining[h] = remaining[h][:n], remaining[h][n:]
+            rows += [
+                {"lon": float(h), "lat": float(i), "stratum": h,
+                 "carbon_kg": population[h][i]}
+                for i in picked
+            ]
+        return pd.DataFrame(rows)
+
+    return draw
+
+
+def test_converges_to_target_precision():
+    population = make_population()
+    counts = {h: len(v) for h, v in population.items()}
+    true_mean = np.concatenate(list(population.values())).mean()
+
+    df, report = adaptive_stratified_sample(
+        make_draw(population), counts,
+        target_precision=0.02, max_rounds=10, max_pixels=5000
+    )
+
+    assert report["converged"]
+    assert report["achieved_precision"] <= 0.02
+    assert len(df) <= 5000
+    assert report["rounds"] > 1        # initial round alone is not enough
+    assert report["n_vegetated_pixels"] == sum(counts.values())
+
+    # 95% half-width is 2% of the mean; twice that is ~4 standard errors
+    assert abs(report["stratified_mean_acd"] - true_mean) <= 0.04 * true_mean
+
+
+def test_neyman_allocation_favours_variable_strata():
+    population = make_population()
+    counts = {h: len(v) for h, v in population.items()}
+
+    df, _ = adaptive_stratified_sample(
+        make_draw(population), counts, target_precision=0.02, max_pixels=5000
+    )
+
+    sampled = df["stratum"].value_counts()
+    # Stratum 2 is 4× smaller than stratum 0 but ~6× more variable
+    assert sampled[2] > sampled[0] * counts[2] / counts[0]
+
+
+def test_stops_at_pixel_budget():
+    population = make_population()
+    counts = {h: len(v) for h, v in population.items()}
+
+    df, report = adaptive_stratified_sample(
+        make_draw(population), counts, target_precision=0.001, max_pixels=600
+    )
+
+    assert not report["converged"]
+    assert len(df) <= 600
+
+
+def test_full_census_is_exact():
+    population = make_population()
+    counts = {h: len(v) for h, v in population.items()}
+    df = pd.concat([
+        pd.DataFrame({"stratum": h, "carbon_kg": v})
+        for h, v in population.items()
+    ])
+
+    estimate = stratified_estimate(df, counts)
+    values = np.concatenate(list(population.values()))
+
+    assert estimate["mean"] == pytest.approx(values.mean())
+    assert estimate["rel_precision"] == pytest.approx(0.0)
+    assert estimate["std"] == pytest.approx(values.std(ddof=1), rel=1e-3)
+
+
+def test_no_vegetation_raises():
+    with pytest.raises(NoVegetationError):
+        adaptive_stratified_sample(lambda a, r: pd.DataFrame(), {0: 0, 1: 0})
+
+    with pytest.raises(NoVegetationError):
+        adaptive_stratified_sample(lambda a, r: pd.DataFrame(), {0: 100})
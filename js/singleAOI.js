@@ -344,7 +344,8 @@ runBtn.addEventListener("click", async () => {
     }, 1200);
 
     try {
-        const response = await fetch("http://127.0.0.1:5000/run-analysis", {
+        // 🔹 STREAM PIXELS BAND BY BAND (NDJSON, one event per line)
+        const response = await fetch("http://127.0.0.1:5000/run-analysis-stream", {
             method: "POST",
             headers: {
                 "Content-Type": "application/json"
@@ -360,7 +361,59 @@ runBtn.addEventListener("click", async () => {
             throw new Error("Backend analysis failed");
         }
 
-        const data = await response.json();
+        const features = [];
+        const pixelLayer = L.layerGroup().addTo(map);
+        let stats = null;
+
+        const handleEvent = (event) => {
+            if (event.type === "pixels") {
+                clearInterval(loadingInterval);
+
+                event.features.forEach(f => {
+                    features.push(f);
+                    const [lon, lat] = f.geometry.coordinates;
+                    L.circleMarker([lat, lon], {
+                        radius: 3,
+                        color: "#1a9850",
+                        weight: 0,
+                        fillOpacity: 0.8
+                    }).addTo(pixelLayer);
+                });
+
+                loadingText.textContent =
+                    `Estimating tree carbon density… band ${event.chunk + 1}/${event.n_chunks} ` +
+                    `(${features.length.toLocaleString()} pixels)`;
+            } else if (event.type === "stats") {
+                stats = event.stats;
+            } else if (event.type === "error") {
+                throw new Error(event.error);
+            }
+        };
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+            const lines = buffer.split("\n");
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+
+            if (done) break;
+        }
+        if (buffer.trim()) handleEvent(JSON.parse(buffer));
+
+        if (!stats) {
+            throw new Error("Analysis stream ended without results");
+        }
+
+        const data = {
+            stats: stats,
+            geojson: { type: "FeatureCollection", features: features }
+        };
 
         // ✅ STORE RESULTS
         localStorage.setItem("analysisResult", JSON.stringify(data));